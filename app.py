@@ -5,6 +5,20 @@ import calendar
 import os
 import plotly.graph_objects as go
 import time
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+from storage import DELETED, DEFAULT_BACKEND, open_storage, partition_name, list_partitions, apply_op, inverse_op, changed_keys, upsert_op, tombstone_op, purge_op, edit_op
+from history import History
+import json
+from ratios import RATIO_FIELDS, RATIO_KINDS, RatioSyntaxError, IncrementalTable, compile_ratios, compute_ratios, peer_stats, ratio_deps
+from formatting import format_frame, format_ratios
+from downsample import lttb
+from fx import BASE_CURRENCY, RATE_COLUMNS, RateTable, currency_prefix, translate
+from consolidation import ELIMINATION_COLUMNS, Consolidation, OwnershipError
+from importer import DATE_ORDERS, LAYOUTS, ImportValidationError, changed_rows, default_mapping, merge_rows, read_csv, read_workbook
+from periods import BASES, GRANULARITIES, GROWTH_LAGS, PERIOD_MONTHS, Rollup, aggregate, growth, period_label
 
 ACCOUNT_FIELDS = [
     'Current Asset', 'Non Current Asset', 'Total Asset',
@@ -14,68 +28,507 @@ ACCOUNT_FIELDS = [
     'Depreciation Expense', 'Total Operating Exp.', 'Operating Income',
     'Other Income and Expense', 'Net Income', 'Tax', 'Income After Tax'
 ]
+FLOW_FIELDS = [
+    'Revenue', 'Administration Exp', 'Employee Expense', 'Marketing Expense',
+    'Rent Expense', 'Right of Use Assets Expense', 'Depreciation Expense',
+    'Total Operating Exp.', 'Operating Income', 'Other Income and Expense',
+    'Net Income', 'Tax', 'Income After Tax'
+]
+NCI_FIELDS = ['Equity', 'Income After Tax']
+
+STORAGE_BACKEND = os.environ.get('FINANCIAL_STORAGE', DEFAULT_BACKEND)
+CUSTOM_RATIOS_FILE = os.path.join('data', 'custom_ratios.json')
+ENTITY_DIR = os.path.join('data', 'entities')
+GROUP_FILE = os.path.join('data', 'group.json')
+FX_FILE = os.path.join('data', 'fx_rates.json')
+CURRENCY_FILE = os.path.join('data', 'currencies.json')
+IMPORT_MAPPING_FILE = os.path.join('data', 'import_mapping.json')
+DEFAULT_ENTITY = os.environ.get('FINANCIAL_ENTITY', 'Default')
+FISCAL_YEAR_START = int(os.environ.get('FISCAL_YEAR_START', 1))
+
+CHANGE_LOG_SIZE = 256
+FORMAT_CACHE_SIZE = 32
+FIGURE_CACHE_SIZE = 16
+TRANSLATION_CACHE_SIZE = 64
+CHART_UNIT = 1e6
+LARGE_DATA_POINTS = 5000
+PIXEL_BUDGET = int(os.environ.get('CHART_PIXEL_BUDGET', 1500))
+UNDO_WINDOW = 10
+
+@st.cache_resource
+def _data_cache(entity):
+    # Shared by every session; the lock keeps a check-then-patch of the frame
+    # from interleaving with another session's.
+    return {'stat': None, 'digest': None, 'df': None, 'hits': 0, 'misses': 0, 'version': 0, 'changes': [], 'lock': threading.RLock()}
+
+def data_cache_stats(entity):
+    cache = _data_cache(entity)
+    return {'hits': cache['hits'], 'misses': cache['misses'], 'version': cache['version']}
+
+def _bump_version(cache, keys):
+    cache['version'] += 1
+    cache['changes'] = cache['changes'][-CHANGE_LOG_SIZE + 1:] + [(cache['version'], keys)]
 
-RATIO_FIELDS = {
-    'Current Ratio': (lambda df: df['Current Asset'] / df['Current Liabilities'].replace(0, pd.NA), 'decimal'),
-    'Debt to Equity Ratio': (lambda df: df['Total Liabilities'] / df['Equity'].replace(0, pd.NA), 'decimal'),
-    'Operating Profit Margin (%)': (lambda df: df['Operating Income'] / df['Revenue'].replace(0, pd.NA), 'percent'),
-    'Net Profit Margin (%)': (lambda df: df['Net Income'] / df['Revenue'].replace(0, pd.NA), 'percent'),
-    'Return on Assets (ROA) (%)': (lambda df: df['Net Income'] / df['Total Asset'].replace(0, pd.NA), 'percent'),
-    'Return on Equity (ROE) (%)': (lambda df: df['Net Income'] / df['Equity'].replace(0, pd.NA), 'percent')
-}
-
-csv_file = os.path.join('data', 'financial_data.csv')
-os.makedirs('data', exist_ok=True)
-
-fmt = lambda x: '' if pd.isna(x) else f"Rp. {int(x):,}" if float(x).is_integer() else f"Rp. {x:,.2f}"
-fmt_decimal = lambda x: '' if pd.isna(x) else f"{x:.2f}"
-fmt_percent = lambda x: '' if pd.isna(x) else f"{x*100:.2f}%"
-
-def load_data():
-    if os.path.exists(csv_file):
-        df = pd.read_csv(csv_file)
+def changes_since(entity, version):
+    # Set of (Date, field) pairs changed after `version`; field None means the
+    # whole row. None means the log can't tell, so callers rebuild everything.
+    cache = _data_cache(entity)
+    log = [keys for v, keys in cache['changes'] if v > version]
+    if len(log) != cache['version'] - version or any(keys is None for keys in log):
+        return None
+    return set().union(*log)
+
+def invalidate_data_cache(entity):
+    cache = _data_cache(entity)
+    with cache['lock']:
+        cache['stat'] = cache['digest'] = cache['df'] = None
+        _bump_version(cache, None)
+
+def list_entities():
+    return [DEFAULT_ENTITY] + [e for e in list_partitions(ENTITY_DIR) if e != DEFAULT_ENTITY]
+
+@st.cache_resource
+def get_storage(entity):
+    # Every entity is its own partition, so reading or writing one company never
+    # touches another's files. The default entity keeps the original
+    # single-company files in data/.
+    if entity == DEFAULT_ENTITY:
+        storage = open_storage(STORAGE_BACKEND, 'data', ACCOUNT_FIELDS)
     else:
-        df = pd.DataFrame(columns=['Date'] + ACCOUNT_FIELDS)
-    for col in ['Date'] + ACCOUNT_FIELDS:
-        if col not in df.columns:
-            df[col] = 0
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-    for f in ACCOUNT_FIELDS:
-        df[f] = pd.to_numeric(df[f], errors='coerce').fillna(0)
-    return df
-
-def save_data(df):
-    df.to_csv(csv_file, index=False)
-
-def delete_date(df, label_str):
+        storage = open_storage(STORAGE_BACKEND, ENTITY_DIR, ACCOUNT_FIELDS, partition_name(entity))
+    # Tombstones past the undo window are purged on open, but only when there
+    # are any, so opening a clean partition never appends to its journal.
+    cutoff = time.time() - UNDO_WINDOW
+    if (storage.read(['Date'], deleted=True)[DELETED] < cutoff).any():
+        storage.apply(purge_op(cutoff))
+    return storage
+
+def _file_stat(storage):
+    files = [p for p in storage.files() if os.path.exists(p)]
+    return files, tuple((os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in files) or None
+
+def load_data(entity):
+    # Keyed on (mtime, size) first; the content hash is only taken when the stat
+    # changed, so a rewrite with identical bytes still counts as a hit.
+    storage = get_storage(entity)
+    cache = _data_cache(entity)
+    with cache['lock']:
+        files, stat = _file_stat(storage)
+        digest = None
+        if cache['df'] is not None and stat == cache['stat']:
+            cache['hits'] += 1
+            return cache['df']
+        if stat is not None:
+            h = hashlib.blake2b(digest_size=16)
+            for p in files:
+                with open(p, 'rb') as fh:
+                    h.update(fh.read())
+            digest = h.hexdigest()
+            if cache['df'] is not None and digest == cache['digest']:
+                cache['stat'] = stat
+                cache['hits'] += 1
+                return cache['df']
+        cache['misses'] += 1
+        cache['df'], cache['stat'], cache['digest'] = storage.read(), stat, digest
+        _bump_version(cache, None)
+        return cache['df']
+
+def current_data(entity):
+    # The frame and the version it is at, taken under one lock. Tabs fetch the
+    # pair themselves and key every cached view on it, so a frame from before
+    # a write is never cached under the version after it.
+    cache = _data_cache(entity)
+    with cache['lock']:
+        return load_data(entity), cache['version']
+
+@st.cache_resource
+def _format_cache():
+    return OrderedDict()
+
+@st.cache_resource
+def _figure_cache():
+    return OrderedDict()
+
+@st.cache_resource
+def _lru_lock():
+    return threading.Lock()
+
+def _lru(cache, size, key, build):
+    # The caches are shared by every session's thread, so lookups and inserts
+    # hold a lock; the build runs outside it so a slow one doesn't stall other
+    # sessions, at the cost of two sessions occasionally building the same key.
+    with _lru_lock():
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = build()
+    with _lru_lock():
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > size:
+            cache.popitem(last=False)
+    return value
+
+def _memoize(cache, size, entity, version, key, build):
+    # Keyed on the rate version too: anything shown in another currency goes
+    # stale when the rates or the entity's reporting currency change.
+    return _lru(cache, size, (entity, version, fx_version()) + key, build)
+
+def cached_view(entity, version, key, build):
+    # Rendered tables only change when the data (or the rates) do, so they are
+    # memoized on the data version they were built from and rebuilt lazily
+    # after a write.
+    return _memoize(_format_cache(), FORMAT_CACHE_SIZE, entity, version, key, build)
+
+def cached_figure(entity, version, key, build):
+    # Same for chart figures, in a smaller LRU of their own since a figure
+    # holds a copy of every plotted column.
+    return _memoize(_figure_cache(), FIGURE_CACHE_SIZE, entity, version, key, build)
+
+def load_custom_ratios():
+    if not os.path.exists(CUSTOM_RATIOS_FILE):
+        return {}
+    with open(CUSTOM_RATIOS_FILE) as fh:
+        return {name: tuple(spec) for name, spec in json.load(fh).items()}
+
+def save_custom_ratios(custom):
+    with open(CUSTOM_RATIOS_FILE, 'w') as fh:
+        json.dump(custom, fh, indent=2)
+
+def all_ratios():
+    return {**RATIO_FIELDS, **load_custom_ratios()}
+
+def load_group():
+    if not os.path.exists(GROUP_FILE):
+        return {'ownership': [], 'eliminations': []}
+    with open(GROUP_FILE) as fh:
+        return json.load(fh)
+
+def save_group(group):
+    with open(GROUP_FILE, 'w') as fh:
+        json.dump(group, fh, indent=2)
+
+def load_fx_rates():
+    if not os.path.exists(FX_FILE):
+        return []
+    with open(FX_FILE) as fh:
+        return json.load(fh)
+
+def save_fx_rates(rows):
+    with open(FX_FILE, 'w') as fh:
+        json.dump(rows, fh, indent=2)
+
+def load_currencies():
+    if not os.path.exists(CURRENCY_FILE):
+        return {}
+    with open(CURRENCY_FILE) as fh:
+        return json.load(fh)
+
+def save_currencies(currencies):
+    with open(CURRENCY_FILE, 'w') as fh:
+        json.dump(currencies, fh, indent=2)
+
+def load_import_mapping():
+    if not os.path.exists(IMPORT_MAPPING_FILE):
+        return default_mapping(ACCOUNT_FIELDS)
+    with open(IMPORT_MAPPING_FILE) as fh:
+        return json.load(fh)
+
+def save_import_mapping(mapping):
+    with open(IMPORT_MAPPING_FILE, 'w') as fh:
+        json.dump(mapping, fh, indent=2)
+
+def entity_currency(entity):
+    return load_currencies().get(entity, BASE_CURRENCY)
+
+def display_currency(entity):
+    choice = st.session_state.get('display_currency', 'Reporting')
+    return entity_currency(entity) if choice == 'Reporting' else choice
+
+def fx_version():
+    # Translations depend on the rate table and on each entity's reporting
+    # currency; their files' mtimes key every translated cache.
+    return tuple(os.stat(p).st_mtime_ns if os.path.exists(p) else None for p in (FX_FILE, CURRENCY_FILE))
+
+@st.cache_resource
+def _rate_table(version):
+    return RateTable(load_fx_rates())
+
+def rate_table():
+    return _rate_table(fx_version())
+
+@st.cache_resource
+def _translation_cache():
+    return OrderedDict()
+
+def display_data(entity, df, version, currency):
+    # The entity's data in `currency`: untouched when that is its reporting
+    # currency, otherwise translated once per data version and target currency
+    # so switching the display currency back and forth reuses earlier work.
+    source = entity_currency(entity)
+    if currency == source:
+        return df
+    return _memoize(_translation_cache(), TRANSLATION_CACHE_SIZE, entity, version, ('translated', currency), lambda: translate(
+        df, rate_table(), source, currency, ACCOUNT_FIELDS, FLOW_FIELDS
+    ))
+
+@st.cache_resource
+def _consolidation(ownership, eliminations, currency, version):
+    return Consolidation(ownership, eliminations, ACCOUNT_FIELDS, NCI_FIELDS)
+
+def consolidation(group, currency):
+    # One engine per group structure and presentation currency; each refresh
+    # feeds it the change logs of the entities in the tree so only their
+    # ancestors are recomputed. Members are translated into `currency` first.
+    engine = _consolidation(
+        tuple(tuple(link) for link in group['ownership']),
+        tuple(tuple(row) for row in group['eliminations']),
+        currency, fx_version()
+    )
+    data = {e: current_data(e) for e in engine.tree.entities}
+    frames = {e: display_data(e, df, version, currency) for e, (df, version) in data.items()}
+    versions = {e: version for e, (_, version) in data.items()}
+    changes = {e: changes_since(e, engine.versions[e]) for e in engine.tree.entities if e in engine.versions}
+    return engine.refresh(frames, versions, changes)
+
+@st.cache_resource
+def _ratio_table(entity, items, basis):
+    # TTM and YTD values at a month depend on up to the previous eleven months,
+    # so those tables refresh a twelve-month window around each change.
+    ratios = {name: (expression, kind) for name, expression, kind in items}
+    return IncrementalTable(
+        lambda rows: compute_ratios(aggregate(rows, basis, FLOW_FIELDS, FISCAL_YEAR_START).set_index('Date'), ratios),
+        ratio_deps(ratios, ACCOUNT_FIELDS),
+        window=1 if basis == 'Monthly' else 12
+    )
+
+def ratio_table(entity, df, version, ratios, basis='Monthly'):
+    table = _ratio_table(entity, tuple((name, expression, kind) for name, (expression, kind) in ratios.items()), basis)
+    changes = changes_since(entity, table.version) if table.version is not None else None
+    return table.refresh(df, version, changes), table
+
+@st.cache_resource
+def _rollup(entity, granularity, currency, version):
+    return Rollup(granularity, ACCOUNT_FIELDS, FLOW_FIELDS, FISCAL_YEAR_START)
+
+def rollup_table(entity, df, version, granularity, currency=None):
+    # Translation is row by row, so a translated frame's roll-up refreshes from
+    # the same change log; it is kept apart per currency and rate table.
+    table = _rollup(entity, granularity, currency, fx_version() if currency else None)
+    changes = changes_since(entity, table.version) if table.version is not None else None
+    return table.refresh(df, version, changes), table
+
+def entity_ratios(entity, df, version, ratios, granularity='Monthly', basis='Monthly'):
+    if granularity == 'Monthly':
+        return ratio_table(entity, df, version, ratios, basis)[0]
+    values, _ = rollup_table(entity, df, version, granularity)
+    return cached_view(entity, version, ('period_ratios', tuple(ratios.items()), granularity), lambda: compute_ratios(values.set_index('Date'), ratios))
+
+def peer_comparison(ratios, granularity='Monthly', basis='Monthly'):
+    # Every entity's ratios stacked into one (Entity, Date) frame with their
+    # ranks, percentiles and per-period quartiles. Per-entity tables refresh
+    # incrementally; the stacked stats are rebuilt only when some entity's data
+    # version moved.
+    data = {e: current_data(e) for e in list_entities()}
+    frames = {e: entity_ratios(e, df, version, ratios, granularity, basis) for e, (df, version) in data.items()}
+    key = ('peers', tuple((e, version) for e, (_, version) in data.items()), tuple(ratios.items()), granularity, basis)
+    def build():
+        values = pd.concat(frames, names=['Entity', 'Date'])
+        return (values,) + peer_stats(values)
+    return _lru(_format_cache(), FORMAT_CACHE_SIZE, key, build)
+
+def rollup_pivot(values, granularity):
+    pivot_df = values.set_index(period_label(values['Date'], granularity, FISCAL_YEAR_START).rename('Period'))
+    return pd.concat([format_frame(pivot_df[ACCOUNT_FIELDS].T, unit=1e6), format_frame(pivot_df[['Months']].T)])
+
+def _add_lines(fig, x, columns, hover, budget=None):
+    # With a budget (large-data mode) traces go to WebGL and each is cut to
+    # `budget` points by LTTB before anything is serialized for the browser.
+    values = columns.to_numpy('float64', na_value=float('nan'))
+    for f, y in zip(columns.columns, values.T):
+        keep = lttb(y, budget) if budget else slice(None)
+        fig.add_trace((go.Scattergl if budget else go.Scatter)(
+            x=x[keep],
+            y=y[keep],
+            mode='lines' if budget else 'lines+markers',
+            name=f,
+            hovertemplate=hover(f)
+        ))
+
+def with_payload(fig):
+    return fig, len(fig.to_json()), sum(len(trace.x) for trace in fig.data)
+
+def trend_figure(plot_df, fields, scope, x_title, unit=CHART_UNIT, budget=None, currency=BASE_CURRENCY):
+    fig = go.Figure()
+    prefix = currency_prefix(currency)
+    _add_lines(fig, plot_df.index, plot_df[fields] / unit, lambda f: f"%{{x}}<br>{f}: {prefix}%{{y:,.0f}} Mio<extra></extra>", budget)
+    fig.update_layout(
+        title=f"Financial Trends (in Millions of {currency}, {scope})",
+        xaxis_title=x_title,
+        yaxis=dict(tickformat=",.0f", tickprefix=prefix),
+        legend=dict(orientation="h", y=-0.3, x=0.5, xanchor="center")
+    )
+    return fig
+
+def growth_figure(delta, pct, fields, title, x_title, percent=True, unit=CHART_UNIT, budget=None, currency=BASE_CURRENCY):
+    fig = go.Figure()
+    values = pct[fields] * 100 if percent else delta[fields] / unit
+    _add_lines(fig, pct.index, values, lambda f: f"%{{x}}<br>{f}: %{{y:,.2f}}{'%' if percent else f' {currency} Mio'}<extra></extra>", budget)
+    fig.update_layout(
+        title=title,
+        xaxis_title=x_title,
+        yaxis=dict(ticksuffix="%" if percent else ""),
+        legend=dict(orientation="h", y=-0.3, x=0.5, xanchor="center")
+    )
+    return fig
+
+def storage_pivot(df):
+    df_sorted = df.sort_values("Date")
+    pivot_df = df_sorted.set_index(df_sorted['Date'].dt.strftime('%b %Y').rename('Month-Year'))[ACCOUNT_FIELDS].T
+    return format_frame(pivot_df, unit=1e6)
+
+def save_data(entity, df):
+    get_storage(entity).write(df)
+    invalidate_data_cache(entity)
+
+def entity_history(entity):
+    return st.session_state['history'].setdefault(entity, History())
+
+def commit_op(entity, df, op, label=None):
+    # Writes the op through to the entity's storage and patches the shared frame
+    # in place of a reload, logging only the touched cells for downstream
+    # caches. Labelled ops are recorded in the session's undo history.
+    if label:
+        entity_history(entity).record(label, op, inverse_op(df, op))
+    storage = get_storage(entity)
+    cache = _data_cache(entity)
+    with cache['lock']:
+        fresh = cache['df'] is not None and _file_stat(storage)[1] == cache['stat']
+        storage.apply(op)
+        patched = apply_op(df, op)
+        if fresh:
+            cache['df'] = patched if cache['df'] is df else apply_op(cache['df'], op)
+            cache['stat'], cache['digest'] = _file_stat(storage)[1], None
+            _bump_version(cache, changed_keys(op))
+        else:
+            invalidate_data_cache(entity)
+    return patched
+
+def upsert_rows(entity, df, rows, label=None):
+    return commit_op(entity, df, upsert_op(rows), label)
+
+def pivot_to_cells(pivot, unit=1e6):
+    dates = pd.to_datetime(pivot.columns, format='%b %Y') + pd.offsets.MonthEnd(0)
+    values = pivot[pivot.index.isin(ACCOUNT_FIELDS)].set_axis(dates, axis=1)
+    cells = values.rename_axis('Field').reset_index().melt(id_vars='Field', var_name='Date', value_name='Value')
+    cells['Value'] = pd.to_numeric(cells['Value'].astype(str).str.replace(',', '', regex=False), errors='coerce') * unit
+    cells = cells.dropna(subset=['Value']).drop_duplicates(['Date', 'Field'], keep='last')
+    return cells[['Date', 'Field', 'Value']]
+
+def dirty_cells(edited, original, unit=1e6):
+    # Only cells whose text differs from what was rendered.
+    before = original.reindex(index=edited.index, columns=edited.columns).fillna('').astype(str)
+    after = edited.fillna('').astype(str)
+    return pivot_to_cells(edited.where(after.ne(before)), unit)
+
+def delete_date(entity, df, label_str):
     ts = pd.to_datetime(label_str, format='%b %Y')
     month = ts.month
     year = ts.year
     last_day = calendar.monthrange(year, month)[1]
     actual_date = pd.Timestamp(datetime.date(year, month, last_day))
-    backup = df.copy()
-    df = df[df['Date'] != actual_date].reset_index(drop=True)
-    save_data(df)
-    return df, backup
+    deleted = df[df['Date'] == actual_date]
+    df = commit_op(entity, df, tombstone_op([actual_date], time.time()), f"delete {label_str}")
+    return df, deleted
+
+def import_frames(frames, label):
+    # One upsert per entity partition, holding only rows that are new or
+    # changed against what is stored; fields the file didn't map keep their
+    # stored values. Partitions don't share a transaction, so
+    # if any write fails the ones already applied are reverted through their
+    # inverse ops; history is only recorded once every entity went in.
+    applied = []
+    try:
+        for target, rows in frames.items():
+            df = load_data(target)
+            rows = changed_rows(merge_rows(rows, df, ACCOUNT_FIELDS), df, ACCOUNT_FIELDS)
+            if rows.empty:
+                continue
+            op = upsert_op(rows)
+            inverse = inverse_op(df, op)
+            commit_op(target, df, op)
+            applied.append((target, op, inverse))
+    except Exception:
+        for target, _, inverse in reversed(applied):
+            commit_op(target, load_data(target), inverse)
+        raise
+    for target, op, inverse in applied:
+        entity_history(target).record(label, op, inverse)
+    return sum(len(op['rows']) for _, op, _ in applied)
 
 st.title("Financial Dashboard")
-df = load_data()
-if 'data' not in st.session_state:
-    st.session_state['data'] = df
+entity = st.sidebar.selectbox("Entity", list_entities(), key='entity')
+df = load_data(entity)
 if 'backup' not in st.session_state:
     st.session_state['backup'] = None
+if 'backup_entity' not in st.session_state:
+    st.session_state['backup_entity'] = None
 if 'undo_timer' not in st.session_state:
     st.session_state['undo_timer'] = None
-if 'rerun_flag' not in st.session_state:
-    st.session_state['rerun_flag'] = False
+if 'tab_timings' not in st.session_state:
+    st.session_state['tab_timings'] = {}
 if 'toast' not in st.session_state:
     st.session_state['toast'] = None
+if 'history' not in st.session_state:
+    st.session_state['history'] = {}
 
-input_tab, storage_tab, analysis_tab = st.tabs(["Input", "Storage", "Analysis"])
+currency_options = ['Reporting'] + rate_table().currencies
+st.sidebar.selectbox("Display currency", currency_options, key='display_currency', help=f"Reporting shows each entity in its own currency; rates are quoted in {BASE_CURRENCY}.")
 
-with input_tab:
+cache_stats = data_cache_stats(entity)
+st.sidebar.caption(f"Data cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses (version {cache_stats['version']})")
+
+history = entity_history(entity)
+undo_col, redo_col = st.sidebar.columns(2)
+if undo_col.button("Undo", disabled=not history.undo_stack):
+    label, op = history.undo()
+    df = commit_op(entity, df, op)
+    st.session_state['toast'] = f"Undone: {label}."
+if redo_col.button("Redo", disabled=not history.redo_stack):
+    label, op = history.redo()
+    df = commit_op(entity, df, op)
+    st.session_state['toast'] = f"Redone: {label}."
+st.sidebar.caption(f"History: {len(history.undo_stack)} undo / {len(history.redo_stack)} redo ({history.size / 1024:.1f} KiB)")
+if st.session_state['tab_timings']:
+    st.sidebar.caption("Last render: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in st.session_state['tab_timings'].items()))
+
+if st.session_state.get('toast'):
+    st.success(st.session_state['toast'])
+    st.session_state['toast'] = None
+
+def tab_fragment(name):
+    # Tab bodies run as fragments, so a widget inside one reruns only that tab.
+    # The time of each tab's last run is kept for the sidebar.
+    def wrap(body):
+        @st.fragment
+        @functools.wraps(body)
+        def run():
+            started = time.perf_counter()
+            body()
+            elapsed = (time.perf_counter() - started) * 1000
+            st.session_state['tab_timings'][name] = elapsed
+            st.caption(f"{name} tab rendered in {elapsed:.0f} ms.")
+        return run
+    return wrap
+
+@tab_fragment("Input")
+def input_tab_body():
     st.header("Input Financial Data")
+    entity = st.session_state['entity']
     with st.form("input_form", clear_on_submit=True):
+        entities = list_entities()
+        target = st.selectbox("Entity", entities, index=entities.index(entity))
+        new_entity = st.text_input("Or add a new entity").strip()
         today = datetime.date.today()
         year = st.selectbox("Year", list(range(2000, today.year + 2)), index=list(range(2000, today.year + 2)).index(today.year))
         month = st.selectbox("Month", list(calendar.month_name)[1:], index=today.month - 1)
@@ -84,36 +537,86 @@ with input_tab:
             last_day = calendar.monthrange(year, list(calendar.month_name)[1:].index(month) + 1)[1]
             date = datetime.date(year, list(calendar.month_name)[1:].index(month) + 1, last_day)
             ts = pd.Timestamp(date)
+            target = new_entity or target
+            df = load_data(target)
             exists = (df['Date'] == ts).any()
             r = {'Date': ts}; r.update(dict(zip(ACCOUNT_FIELDS, inputs)))
 
             if exists:
                 overwrite = st.checkbox(f"Data for {ts.strftime('%b %Y')} exists. Check to confirm overwrite.")
                 if overwrite:
-                    df = df[df['Date'] != ts]
-                    df = pd.concat([df, pd.DataFrame([r])], ignore_index=True)
-                    save_data(df)
-                    st.session_state['data'] = df
-                    st.session_state['toast'] = "Data overwritten successfully."
-                    st.session_state['rerun_flag'] = True
+                    upsert_rows(target, df, pd.DataFrame([r]), f"overwrite {ts.strftime('%b %Y')}")
+                    st.session_state['toast'] = f"Data for {target} overwritten successfully."
+                    st.rerun()
             else:
-                df = pd.concat([df, pd.DataFrame([r])], ignore_index=True)
-                save_data(df)
-                st.session_state['data'] = df
-                st.session_state['toast'] = "Data saved successfully."
-                st.session_state['rerun_flag'] = True
+                upsert_rows(target, df, pd.DataFrame([r]), f"save {ts.strftime('%b %Y')}")
+                st.session_state['toast'] = f"Data for {target} saved successfully."
+                st.rerun()
 
-with storage_tab:
+    st.subheader("Bulk Import")
+    upload = st.file_uploader("Excel workbook or CSV extract", type=['xlsx', 'csv'], key='import_file')
+    is_csv = upload is not None and upload.name.lower().endswith('.csv')
+    layout = st.radio("Layout", LAYOUTS, horizontal=True, key='import_layout', disabled=is_csv,
+                      format_func={'records': "One row per entity and month", 'sheets': "One sheet per entity"}.get,
+                      help=f"CSV extracts are always one row per entity and month; rows without an entity column go to {entity}.")
+    dayfirst = st.radio("Dates", [None, True, False], horizontal=True, key='import_dayfirst',
+                        format_func={None: "Detect", **DATE_ORDERS}.get,
+                        help="Order of dates written as numbers, one order per file. Detect takes the order the file's unambiguous dates (e.g. 31/03/2024) follow.")
+    with st.expander("Column mapping"):
+        st.caption("Sheet labels (column headers, or row labels for one sheet per entity) and the field each maps to. Matching ignores case and punctuation.")
+        mapping = load_import_mapping()
+        edited_mapping = st.data_editor(
+            pd.DataFrame(list(mapping.items()), columns=['Label', 'Field']),
+            num_rows='dynamic', hide_index=True, key='import_mapping',
+            column_config={'Field': st.column_config.SelectboxColumn(options=['Entity', 'Date'] + ACCOUNT_FIELDS, required=True)},
+        ).dropna()
+        mapping = dict(zip(edited_mapping['Label'].astype(str), edited_mapping['Field']))
+        if st.button("Save Mapping"):
+            save_import_mapping(mapping)
+            st.success("Mapping saved.")
+    if upload is not None and st.button("Import"):
+        bar = st.progress(0.0, text=f"Reading {upload.name}...")
+        started = time.perf_counter()
+        read = {'rows': 0}
+        def progress(sheet, sheets, rows):
+            read['rows'] += rows
+            bar.progress((sheet + 1) / sheets, text=f"Validated {read['rows']:,} rows from sheet {sheet + 1} of {sheets}...")
+        def csv_progress(done, total, rows):
+            elapsed = time.perf_counter() - started
+            bar.progress(done / max(total, 1), text=f"Parsed {rows:,} rows ({done / 2**20:.1f} of {total / 2**20:.1f} MiB) at {rows / elapsed:,.0f} rows/s...")
+        try:
+            if is_csv:
+                frames = read_csv(upload, ACCOUNT_FIELDS, mapping, entity, progress=csv_progress, dayfirst=dayfirst)
+            else:
+                frames = read_workbook(upload, ACCOUNT_FIELDS, mapping, layout, progress=progress, dayfirst=dayfirst)
+        except ImportValidationError as e:
+            bar.empty()
+            st.error(f"Nothing was imported: {len(e.problems)} problem(s) in {upload.name}.")
+            st.dataframe(pd.DataFrame({'Problem': e.problems[:200]}), hide_index=True)
+            return
+        total = sum(len(rows) for rows in frames.values())
+        bar.progress(1.0, text=f"Writing {total:,} rows for {len(frames)} entities...")
+        rows = import_frames(frames, f"import {upload.name}")
+        elapsed = time.perf_counter() - started
+        st.session_state['toast'] = (f"Imported {rows:,} new or changed rows ({total - rows:,} unchanged) for {len(frames)} entities "
+                                     f"from {upload.name} in {elapsed:.1f} s ({total / elapsed:,.0f} rows/s).")
+        st.rerun()
+
+@tab_fragment("Storage")
+def storage_tab_body():
     st.header("Stored Financial Data (Editable)")
-    st.caption("*All values are displayed in millions (Rp. Mio)*")
-    df = st.session_state['data']
-    df_sorted = df.sort_values("Date")
-    if df_sorted.empty:
+    entity = st.session_state['entity']
+    currency = entity_currency(entity)
+    st.caption(f"*{entity}: all values are displayed in millions ({currency} Mio), the entity's reporting currency*")
+    df, version = current_data(entity)
+    if df.empty:
         st.info("No data available.")
+    elif (storage_granularity := st.radio("Granularity", GRANULARITIES, horizontal=True, key='storage_granularity')) != 'Monthly':
+        values, rollup = rollup_table(entity, df, version, storage_granularity)
+        st.dataframe(cached_view(entity, version, ('rollup_pivot', storage_granularity), lambda: rollup_pivot(values, storage_granularity)), use_container_width=True)
+        st.caption(f"{rollup.refreshed} periods re-aggregated at data version {rollup.version}. Switch to Monthly to edit.")
     else:
-        df_sorted['Month-Year'] = df_sorted['Date'].dt.strftime('%b %Y')
-        pivot_df = df_sorted.set_index('Month-Year')[ACCOUNT_FIELDS].T
-        pivot_df = pivot_df.applymap(lambda x: f"{round(x / 1e6):,}" if pd.notna(x) else '')
+        pivot_df = cached_view(entity, version, ('pivot',), lambda: storage_pivot(df))
 
         st.subheader("Edit or Correct Financial Data")
 
@@ -125,96 +628,254 @@ with storage_tab:
             return ['font-weight: bold; background-color: #f4e2d8' if row.name in important else '' for _ in row]
 
         pivot_df_styled = pivot_df.style.apply(highlight_key_rows, axis=1)
-        editable_df = st.data_editor(pivot_df, use_container_width=True, num_rows="dynamic")
+        editable_df = st.data_editor(pivot_df, use_container_width=True)
 
         if st.button("Save Changes"):
-            for month_year in editable_df.columns:
-                dt = pd.to_datetime(month_year, format="%b %Y")
-                last_day = calendar.monthrange(dt.year, dt.month)[1]
-                actual_date = pd.Timestamp(datetime.date(dt.year, dt.month, last_day))
-                for field in ACCOUNT_FIELDS:
-                    try:
-                        edited_val = float(str(editable_df.at[field, month_year]).replace(",", ""))
-                        df.loc[df['Date'] == actual_date, field] = edited_val * 1e6
-                    except:
-                        pass
-            save_data(df)
-            st.session_state['data'] = df
-            st.success("Changes saved successfully.")
+            cells = dirty_cells(editable_df, pivot_df)
+            if cells.empty:
+                st.info("No changes to save.")
+            else:
+                commit_op(entity, df, edit_op(cells), f"edit {len(cells)} cells")
+                st.session_state['toast'] = f"Changes saved successfully ({len(cells)} cells updated)."
+                st.rerun()
 
         delete_target = st.selectbox("Select a period to delete:", pivot_df.columns.tolist())
         if st.button("Delete Selected"):
-            df, backup = delete_date(df, delete_target)
-            st.session_state['data'] = df
+            df, backup = delete_date(entity, df, delete_target)
             st.session_state['backup'] = backup
+            st.session_state['backup_entity'] = entity
             st.session_state['undo_timer'] = time.time()
             st.session_state['toast'] = f"Data for {delete_target} deleted."
-            st.session_state['rerun_flag'] = True
+            st.rerun()
 
-        if st.session_state['backup'] is not None and st.session_state['undo_timer']:
-            remaining = 10 - (time.time() - st.session_state['undo_timer'])
+        if st.session_state['backup'] is not None and st.session_state['undo_timer'] and st.session_state['backup_entity'] == entity:
+            remaining = UNDO_WINDOW - (time.time() - st.session_state['undo_timer'])
             if remaining > 0:
                 st.info(f"You can undo delete in {int(remaining)} seconds.")
                 if st.button("Undo Delete"):
-                    st.session_state['data'] = st.session_state['backup']
-                    save_data(st.session_state['backup'])
+                    upsert_rows(entity, df, st.session_state['backup'], "undo delete")
                     st.session_state['backup'] = None
                     st.session_state['undo_timer'] = None
                     st.session_state['toast'] = "Deletion undone."
-                    st.session_state['rerun_flag'] = True
+                    st.rerun()
             else:
+                df = commit_op(entity, df, purge_op(time.time() - UNDO_WINDOW))
                 st.session_state['backup'] = None
                 st.session_state['undo_timer'] = None
 
-if st.session_state.get('toast'):
-    st.success(st.session_state['toast'])
-    st.session_state['toast'] = None
-
-if st.session_state.get('rerun_flag'):
-    st.session_state['rerun_flag'] = False
-    st.stop()
-    st.experimental_rerun()
+    with st.expander("Currencies and FX rates"):
+        rates = rate_table()
+        options = sorted(set(rates.currencies) | {currency})
+        reporting = st.selectbox(f"Reporting currency of {entity}", options, index=options.index(currency))
+        if reporting != currency:
+            save_currencies({**load_currencies(), entity: reporting})
+            st.rerun()
+        st.caption(f"Rates are {BASE_CURRENCY} per unit of currency: Closing at month end for balance sheet fields, Average over the month for income statement fields.")
+        fx_rows = st.data_editor(
+            pd.DataFrame(load_fx_rates(), columns=RATE_COLUMNS).astype({'Date': 'datetime64[ns]'}),
+            num_rows="dynamic", use_container_width=True, key='fx_editor',
+            column_config={'Date': st.column_config.DateColumn(format="MMM YYYY")}
+        )
+        if st.button("Save FX Rates"):
+            fx_rows = fx_rows.dropna()
+            save_fx_rates([[pd.Timestamp(d).strftime('%Y-%m-%d'), c.strip().upper(), float(close), float(avg)] for d, c, close, avg in fx_rows.itertuples(index=False)])
+            st.rerun()
 
-with analysis_tab:
+@tab_fragment("Analysis")
+def analysis_tab_body():
     st.header("Financial Analysis")
-    df = st.session_state['data']
-    if df.empty:
+    entity = st.session_state['entity']
+    currency = display_currency(entity)
+    st.caption(f"{entity}, amounts in {currency}")
+    data, version = current_data(entity)
+    if data.empty:
         st.info("No data to analyze.")
     else:
-        df['Label'] = df['Date'].dt.strftime('%b %Y')
-        df.set_index('Label', inplace=True)
+        granularity = st.radio("Granularity", GRANULARITIES, horizontal=True, key='analysis_granularity', help="Quarters and years follow the fiscal year; income statement fields are summed and balance sheet fields taken at period end.")
+        basis = st.radio("Basis", BASES, horizontal=True, disabled=granularity != 'Monthly', help="TTM and YTD sum income statement fields over the trailing twelve months or the year to date; balance sheet fields stay point-in-time.")
+        ratios = all_ratios()
+        if granularity == 'Monthly':
+            ratio_values, table = ratio_table(entity, data, version, ratios, basis)
+            df = display_data(entity, data, version, currency).sort_values('Date')
+            scope = basis
+        else:
+            df, table = rollup_table(entity, display_data(entity, data, version, currency), version, granularity, currency)
+            ratio_values = entity_ratios(entity, data, version, ratios, granularity)
+            basis = 'Monthly'
+            scope = granularity
+        df = df.set_index(period_label(df['Date'], granularity, FISCAL_YEAR_START).rename('Label'))
+        x_title = "Month-Year" if granularity == 'Monthly' else "Period"
 
         selected = st.multiselect("Select Fields to Plot", ACCOUNT_FIELDS, default=[])
+        budget, window = None, slice(None)
+        if selected and len(df) * len(selected) > LARGE_DATA_POINTS:
+            # Large-data mode: the zoom range re-fetches its slice from the full
+            # series, so a narrow enough window is drawn at full resolution.
+            budget = st.number_input("Points per trace", 100, 20000, PIXEL_BUDGET, step=100, help="Series longer than this are downsampled with LTTB.")
+            lo, hi = st.select_slider("Zoom", options=range(len(df)), value=(0, len(df) - 1), format_func=lambda i: df.index[i])
+            window = slice(lo, hi + 1)
         if selected:
-            fig = go.Figure()
-            for f in selected:
-                fig.add_trace(go.Scatter(
-                    x=df.index,
-                    y=df[f] / 1e6,
-                    mode='lines+markers',
-                    name=f,
-                    hovertemplate=f"%{{x}}<br>{f}: Rp. %{{y:,.0f}} Mio<extra></extra>"
-                ))
-            fig.update_layout(
-                title="Financial Trends (in Millions)",
-                xaxis_title="Month-Year",
-                yaxis=dict(tickformat=",.0f", tickprefix="Rp. "),
-                legend=dict(orientation="h", y=-0.3, x=0.5, xanchor="center")
-            )
+            def trend_frame():
+                if granularity != 'Monthly':
+                    return df[['Date'] + selected]
+                plot_df = aggregate(df[['Date'] + selected].reset_index(drop=True), basis, FLOW_FIELDS, FISCAL_YEAR_START)
+                return plot_df.set_index(plot_df['Date'].dt.strftime('%b %Y').rename('Label'))
+            started = time.perf_counter()
+            fig, payload, points = cached_figure(entity, version, ('trend', tuple(selected), CHART_UNIT, currency, scope, budget, window.start, window.stop), lambda: with_payload(
+                trend_figure(trend_frame().iloc[window], selected, scope, x_title, budget=budget, currency=currency)
+            ))
             st.plotly_chart(fig, use_container_width=True)
-            summary_table = (df[selected].T / 1e6).applymap(fmt)
+            st.caption(f"{points:,} points ({payload / 1024:,.1f} KiB) sent{' via WebGL' if budget else ''}, rendered in {(time.perf_counter() - started) * 1000:.0f} ms.")
+            summary_table = cached_view(entity, version, ('summary', tuple(selected), currency, scope), lambda: format_frame(
+                trend_frame()[selected].T, unit=1e6, decimals=2, prefix=currency_prefix(currency), trim_integers=True
+            ))
             st.dataframe(summary_table, use_container_width=True)
 
         st.subheader("Financial Ratios")
-        ratio_df = pd.DataFrame(index=df.index)
-        for name, (func, _) in RATIO_FIELDS.items():
-            ratio_df[name] = func(df)
-
-        formatted_ratio_df = pd.DataFrame(index=ratio_df.index)
-        for name, (_, typ) in RATIO_FIELDS.items():
-            if typ == 'percent':
-                formatted_ratio_df[name] = ratio_df[name].map(fmt_percent)
+        formatted_ratio_df = cached_view(entity, version, ('ratios', tuple(ratios.items()), scope), lambda: format_ratios(
+            ratio_values.reindex(df['Date']).set_axis(df.index),
+            {name: typ for name, (_, typ) in ratios.items()}
+        ))
+        st.dataframe(formatted_ratio_df.T, use_container_width=True)
+        if granularity == 'Monthly':
+            st.caption(f"{table.recomputed} ratio cells recomputed at data version {table.version}.")
+        else:
+            st.caption(f"{table.refreshed} periods re-aggregated at data version {table.version}.")
+
+        st.subheader("Peer Comparison")
+        if len(list_entities()) < 2:
+            st.info("Add another entity to compare against peers.")
+        elif st.toggle("Compare with peers", help="Ranks this entity's ratios against every other entity for the same period."):
+            peers, rank, percentile, summary = peer_comparison(ratios, granularity, basis)
+            periods = summary.index.get_level_values('Date').unique()
+            labels = period_label(periods, granularity, FISCAL_YEAR_START)
+            at = st.selectbox("Period", range(len(periods)), index=len(periods) - 1, format_func=lambda i: labels[i])
+            date = periods[at]
+            kinds = {name: typ for name, (_, typ) in ratios.items()}
+            stats = summary.xs(date, level='Date')
+            mine = (entity, date) in peers.index
+            position = format_ratios(pd.concat([
+                peers.loc[[(entity, date)]].set_axis(['Value']) if mine else pd.DataFrame(index=['Value'], columns=peers.columns, dtype='float64'),
+                stats.loc[['Q1', 'Median', 'Q3']]
+            ]), kinds)
+            if mine:
+                ranked = rank.loc[(entity, date)]
+                position.loc['Rank'] = (format_frame(ranked.to_frame().T).iloc[0] + format_frame(stats.loc[['Count']], prefix=' of ').iloc[0]).where(ranked.notna(), '')
+                position.loc['Percentile'] = format_frame(percentile.loc[[(entity, date)]], decimals=1, suffix='%', trim_integers=True).iloc[0]
+            st.dataframe(position.T, use_container_width=True)
+            by = st.selectbox("Rank entities by", list(ratios))
+            ranking = pd.DataFrame({
+                by: format_ratios(peers.xs(date, level='Date')[[by]], kinds)[by],
+                'Rank': rank.xs(date, level='Date')[by],
+                'Percentile': format_frame(percentile.xs(date, level='Date')[[by]], decimals=1, suffix='%', trim_integers=True)[by]
+            }).dropna(subset=['Rank']).astype({'Rank': 'int64'}).sort_values('Rank')
+            st.dataframe(ranking, use_container_width=True)
+
+        st.subheader("Growth")
+        period = st.radio("Compare", [p for p, lag in GROWTH_LAGS.items() if lag >= PERIOD_MONTHS[granularity]], horizontal=True)
+        measure = st.radio("Show", ["% change", f"Change ({currency} Mio)"], horizontal=True)
+        delta, pct = cached_view(entity, version, ('growth', period, currency, scope), lambda: growth(
+            aggregate(df, basis, FLOW_FIELDS, FISCAL_YEAR_START), ACCOUNT_FIELDS, GROWTH_LAGS[period]
+        ))
+        if selected:
+            fig = cached_figure(entity, version, ('growth', tuple(selected), CHART_UNIT, currency, scope, period, measure, budget, window.start, window.stop), lambda: growth_figure(
+                delta.iloc[window], pct.iloc[window], selected, f"{period} {measure} ({scope})", x_title, measure == "% change", budget=budget, currency=currency
+            ))
+            st.plotly_chart(fig, use_container_width=True)
+        growth_table = cached_view(entity, version, ('growth_table', period, currency, scope, measure), lambda: (
+            format_frame(pct.T, unit=0.01, decimals=2, suffix='%', grouping=False) if measure == "% change"
+            else format_frame(delta.T, unit=1e6, decimals=2, trim_integers=True)
+        ))
+        st.dataframe(growth_table, use_container_width=True)
+
+        with st.expander("Custom Ratios"):
+            st.caption("Write ratios over account field names, e.g. (Current Asset - Total Operating Exp.) / Current Liabilities")
+            with st.form("custom_ratio_form", clear_on_submit=True):
+                ratio_name = st.text_input("Ratio name")
+                expression = st.text_input("Expression")
+                kind = st.selectbox("Display as", RATIO_KINDS)
+                if st.form_submit_button("Add Ratio"):
+                    custom = load_custom_ratios()
+                    try:
+                        compile_ratios({ratio_name: (expression, kind)}, ACCOUNT_FIELDS)
+                    except RatioSyntaxError as e:
+                        st.error(str(e))
+                    else:
+                        if not ratio_name or ratio_name in RATIO_FIELDS:
+                            st.error("Choose a new, non-empty ratio name.")
+                        else:
+                            custom[ratio_name] = (expression, kind)
+                            save_custom_ratios(custom)
+                            st.success(f"Ratio '{ratio_name}' added.")
+            custom = load_custom_ratios()
+            if custom:
+                remove = st.selectbox("Remove a custom ratio", list(custom))
+                if st.button("Remove Ratio"):
+                    del custom[remove]
+                    save_custom_ratios(custom)
+                    st.success(f"Ratio '{remove}' removed.")
+
+@tab_fragment("Consolidation")
+def consolidation_tab_body():
+    st.header("Group Consolidation")
+    group = load_group()
+
+    with st.expander("Ownership and eliminations", expanded=not group['ownership']):
+        st.caption("Each child has one parent; Share is the parent's holding (1 = 100%). Members are consolidated in full and the outside holders' part shows as non-controlling interest.")
+        ownership = st.data_editor(
+            pd.DataFrame(group['ownership'], columns=['Parent', 'Child', 'Share']),
+            num_rows="dynamic", use_container_width=True, key='ownership_editor',
+            column_config={'Share': st.column_config.NumberColumn(min_value=0.0, max_value=1.0, default=1.0)}
+        )
+        st.caption("Intercompany balances to remove wherever both entities are consolidated together; enter each side (e.g. the receivable and the payable) as its own row.")
+        eliminations = st.data_editor(
+            pd.DataFrame(group['eliminations'], columns=ELIMINATION_COLUMNS).astype({'Date': 'datetime64[ns]'}),
+            num_rows="dynamic", use_container_width=True, key='elimination_editor',
+            column_config={
+                'Date': st.column_config.DateColumn(format="MMM YYYY"),
+                'Field': st.column_config.SelectboxColumn(options=ACCOUNT_FIELDS)
+            }
+        )
+        if st.button("Save Group Structure"):
+            ownership = ownership.dropna(subset=['Parent', 'Child'])
+            eliminations = eliminations.dropna()
+            updated = {
+                'ownership': [[p, c, float(s)] for p, c, s in ownership.fillna({'Share': 1.0}).itertuples(index=False)],
+                'eliminations': [[pd.Timestamp(d).strftime('%Y-%m-%d'), a, b, f, float(v)] for d, a, b, f, v in eliminations.itertuples(index=False)]
+            }
+            try:
+                Consolidation(updated['ownership'], updated['eliminations'], ACCOUNT_FIELDS)
+            except OwnershipError as e:
+                st.error(str(e))
             else:
-                formatted_ratio_df[name] = ratio_df[name].map(fmt_decimal)
+                save_group(updated)
+                group = updated
+                st.success("Group structure saved.")
 
-        st.dataframe(formatted_ratio_df.T, use_container_width=True)
+    if not group['ownership']:
+        st.info("Define an ownership tree to consolidate.")
+        return
+    parent = st.selectbox("Group", sorted({p for p, _, _ in group['ownership']}))
+    currency = display_currency(parent)
+    engine = consolidation(group, currency)
+    df = engine.frame(parent)
+    if df.empty:
+        st.info("No data for this group.")
+        return
+    st.caption(f"*{parent} consolidated: all values are displayed in millions ({currency} Mio); eliminations are entered in this currency*")
+    st.dataframe(storage_pivot(df), use_container_width=True)
+    nci = engine.nci_frame(parent)
+    if nci[NCI_FIELDS].to_numpy().any():
+        st.caption("*Non-controlling interest: the part of the figures above held outside the group*")
+        st.dataframe(format_frame(nci.set_index(nci['Date'].dt.strftime('%b %Y').rename('Month-Year'))[NCI_FIELDS].T, unit=1e6), use_container_width=True)
+    ratios = all_ratios()
+    ratio_df = compute_ratios(df.set_index(df['Date'].dt.strftime('%b %Y').rename('Label'))[ACCOUNT_FIELDS], ratios)
+    st.dataframe(format_ratios(ratio_df, {name: typ for name, (_, typ) in ratios.items()}).T, use_container_width=True)
+    st.caption(f"{engine.recomputed} group periods recomputed.")
+
+# Only the open tab's body runs; switching tabs reruns the app.
+tabs = st.tabs(["Input", "Storage", "Analysis", "Consolidation"], key='active_tab', on_change='rerun')
+for tab, body in zip(tabs, (input_tab_body, storage_tab_body, analysis_tab_body, consolidation_tab_body)):
+    if tab.open:
+        with tab:
+            body()
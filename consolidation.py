@@ -0,0 +1,169 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+ELIMINATION_COLUMNS = ['Date', 'Entity', 'Counterparty', 'Field', 'Amount']
+
+
+class OwnershipError(ValueError):
+    pass
+
+
+class OwnershipTree:
+    # Flattens (parent, child, share) links into a sparse group x entity matrix
+    # with one entry per member of each group (the group itself included).
+    # shares holds the effective holding of group g in entity e, the product of
+    # the shares on the path down, which only the non-controlling interest
+    # uses. Each entity has at most one parent, and cycles are rejected.
+
+    def __init__(self, links):
+        self.parent = {}
+        children = {}
+        for parent, child, share in links:
+            if child in self.parent:
+                raise OwnershipError(f"'{child}' has more than one parent")
+            if parent == child:
+                raise OwnershipError(f"'{child}' cannot own itself")
+            self.parent[child] = (parent, float(share))
+            children.setdefault(parent, []).append(child)
+        for child in self.parent:
+            seen, node = {child}, child
+            while node in self.parent:
+                node = self.parent[node][0]
+                if node in seen:
+                    raise OwnershipError(f"Ownership cycle through '{child}'")
+                seen.add(node)
+        self.groups = sorted(children)
+        self.entities = sorted(set(children) | set(self.parent))
+        position = {e: i for i, e in enumerate(self.entities)}
+        rows, cols, shares = [], [], []
+        for g, group in enumerate(self.groups):
+            stack = [(group, 1.0)]
+            while stack:
+                node, share = stack.pop()
+                rows.append(g)
+                cols.append(position[node])
+                shares.append(share)
+                stack.extend((c, share * self.parent[c][1]) for c in children.get(node, ()))
+        self.rows = np.array(rows, dtype='int64')
+        self.cols = np.array(cols, dtype='int64')
+        self.shares = np.array(shares, dtype='float64')
+        self.dense = np.zeros((len(self.groups), len(self.entities)))
+        self.dense[self.rows, self.cols] = 1.0
+
+    def ancestors(self, entity):
+        # Groups whose consolidated figures include `entity`.
+        if entity not in self.entities:
+            return np.array([], dtype='int64')
+        return np.flatnonzero(self.dense[:, self.entities.index(entity)])
+
+
+def spmm(rows, cols, weights, dense, n_rows):
+    # Sparse (COO, rows sorted) times dense: each output row is the weighted sum
+    # of the dense rows its entries point at, summed with one reduceat.
+    out = np.zeros((n_rows, dense.shape[1]))
+    if len(rows):
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        out[rows[starts]] = np.add.reduceat(weights[:, None] * dense[cols], starts, axis=0)
+    return out
+
+
+class Consolidation:
+    # Consolidated statements for every group, kept per period across reruns.
+    # Full consolidation: every member is summed into the group at 100% (one
+    # sparse multiply of the membership matrix with the period's entity x field
+    # matrix), less intercompany eliminations, and the outside holders' part of
+    # nci_fields is reported separately as the non-controlling interest.
+    # refresh() takes each entity's change log and recomputes only the ancestors
+    # of the changed entity for the changed months. Entities with no row for a
+    # month contribute zero; a blank in a member's row (e.g. a month with no FX
+    # rate to translate it) leaves that field blank for every group holding it.
+
+    def __init__(self, links, eliminations, fields, nci_fields=()):
+        self.tree = OwnershipTree(links)
+        self.fields = fields
+        self.nci_fields = [f for f in nci_fields if f in fields]
+        elims = pd.DataFrame(list(eliminations), columns=ELIMINATION_COLUMNS)
+        elims = elims[elims['Entity'].isin(self.tree.entities) & elims['Counterparty'].isin(self.tree.entities) & elims['Field'].isin(fields)]
+        self.eliminations = elims.assign(Date=pd.to_datetime(elims['Date']) + pd.offsets.MonthEnd(0))
+        self.cube = {}
+        self.values = {}
+        self.nci = {}
+        self.versions = {}
+        self.recomputed = 0
+        self.lock = threading.Lock()
+
+    def _eliminate(self, date, groups):
+        # A balance between two entities is eliminated in full in every group
+        # that holds both, matching the 100% the members are summed at; each
+        # side of the balance is entered as its own row.
+        elims = self.eliminations[self.eliminations['Date'] == date]
+        out = np.zeros((len(groups), len(self.fields)))
+        if elims.empty:
+            return out
+        a = np.searchsorted(self.tree.entities, elims['Entity'].to_numpy())
+        b = np.searchsorted(self.tree.entities, elims['Counterparty'].to_numpy())
+        dense = self.tree.dense[groups]
+        share = dense[:, a] * dense[:, b] * elims['Amount'].to_numpy(dtype='float64')
+        onehot = np.zeros((len(elims), len(self.fields)))
+        onehot[np.arange(len(elims)), [self.fields.index(f) for f in elims['Field']]] = 1
+        return share @ onehot
+
+    def _compute(self, date, groups):
+        keep = np.isin(self.tree.rows, groups)
+        rows, cols = np.searchsorted(groups, self.tree.rows[keep]), self.tree.cols[keep]
+        cube = self.cube[date]
+        values = spmm(rows, cols, np.ones(len(rows)), cube, len(groups)) - self._eliminate(date, groups)
+        nci = [self.fields.index(f) for f in self.nci_fields]
+        outside = 1 - self.tree.shares[keep]
+        held = outside > 0
+        return values, spmm(rows[held], cols[held], outside[held], cube[:, nci], len(groups))
+
+    def refresh(self, frames, versions, changes):
+        # frames and versions map each entity to its frame and data version;
+        # changes maps it to the (Date, field) set changed since the version
+        # last seen here, or None when unknown.
+        with self.lock:
+            dirty = {}
+            for e, entity in enumerate(self.tree.entities):
+                if self.versions.get(entity) == versions[entity]:
+                    continue
+                frame = frames[entity].set_index('Date')
+                keys = changes.get(entity)
+                dates = set(self.cube) | set(frame.index) if keys is None or entity not in self.versions else {d for d, _ in keys}
+                dates = pd.DatetimeIndex(sorted(dates))
+                rows = frame.reindex(dates)[self.fields].to_numpy(dtype='float64', na_value=np.nan)
+                rows = np.where(dates.isin(frame.index)[:, None], rows, 0)
+                for date, row in zip(dates, rows):
+                    if date not in self.cube:
+                        self.cube[date] = np.zeros((len(self.tree.entities), len(self.fields)))
+                        self.values[date] = np.zeros((len(self.tree.groups), len(self.fields)))
+                        self.nci[date] = np.zeros((len(self.tree.groups), len(self.nci_fields)))
+                        dirty[date] = set(range(len(self.tree.groups)))
+                    self.cube[date][e] = row
+                    dirty.setdefault(date, set()).update(self.tree.ancestors(entity).tolist())
+                self.versions[entity] = versions[entity]
+            self.recomputed = 0
+            for date, groups in dirty.items():
+                groups = np.array(sorted(groups), dtype='int64')
+                if len(groups):
+                    self.values[date][groups], self.nci[date][groups] = self._compute(date, groups)
+                    self.recomputed += len(groups)
+            return self
+
+    def _frame(self, group, values, columns):
+        g = self.tree.groups.index(group)
+        members = self.tree.cols[self.tree.rows == g]
+        dates = sorted(d for d in values if self.cube[d][members].any())
+        out = pd.DataFrame([values[d][g] for d in dates], columns=columns)
+        out.insert(0, 'Date', pd.DatetimeIndex(dates))
+        return out
+
+    def frame(self, group):
+        return self._frame(group, self.values, self.fields)
+
+    def nci_frame(self, group):
+        # The part of each nci field (already inside frame()) that belongs to
+        # holders outside the group.
+        return self._frame(group, self.nci, self.nci_fields)
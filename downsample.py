@@ -0,0 +1,26 @@
+import numpy as np
+
+
+def lttb(values, n):
+    # Indices of `n` points picked by Largest-Triangle-Three-Buckets over evenly
+    # spaced x: first and last are kept, and each bucket in between keeps the
+    # point forming the largest triangle with the previous pick and the mean of
+    # the next bucket. Peaks and troughs survive where plain striding drops them.
+    size = len(values)
+    if n >= size or n < 3:
+        return np.arange(size)
+    y = np.nan_to_num(np.asarray(values, dtype='float64'))
+    edges = np.linspace(1, size - 1, n - 1).astype('int64')
+    edges = np.append(edges, size)
+    keep = np.empty(n, dtype='int64')
+    keep[0], keep[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi, nxt = edges[i], edges[i + 1], edges[i + 2]
+        cx = (hi + nxt - 1) / 2
+        cy = y[hi:nxt].mean()
+        x = np.arange(lo, hi)
+        area = np.abs((a - cx) * (y[lo:hi] - y[a]) - (a - x) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        keep[i + 1] = a
+    return keep
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+
+def _group_thousands(ints):
+    # Builds "1,234,567" from non-negative int64s one 3-digit group per pass,
+    # so the cost is O(cells * groups) in NumPy rather than a Python call per cell.
+    top = ints
+    tail = np.full(ints.shape, '', dtype='U1')
+    while (wide := top >= 1000).any():
+        group = np.char.zfill((top % 1000).astype('U3'), 3)
+        tail = np.where(wide, np.char.add(np.char.add(',', group), tail), tail)
+        top = np.where(wide, top // 1000, top)
+    return np.char.add(top.astype('U20'), tail)
+
+
+def format_values(values, unit=1, decimals=0, prefix='', suffix='', grouping=True, trim_integers=False):
+    values = np.asarray(values, dtype='float64') / unit
+    if not values.size:
+        return values.astype(object)
+    missing = ~np.isfinite(values)
+    scale = 10 ** decimals
+    scaled = np.round(np.abs(np.where(missing, 0, values)) * scale).astype('int64')
+    whole, frac = scaled // scale, scaled % scale
+    text = _group_thousands(whole) if grouping else whole.astype('U20')
+    if decimals:
+        fraction = np.char.add('.', np.char.zfill(frac.astype('U20'), decimals))
+        if trim_integers:
+            fraction = np.where(values == np.floor(values), '', fraction)
+        text = np.char.add(text, fraction)
+    text = np.where((values < 0) & (scaled > 0), np.char.add('-', text), text)
+    text = np.char.add(np.char.add(prefix, text), suffix)
+    return np.where(missing, '', text).astype(object)
+
+
+def format_frame(df, **kwargs):
+    return pd.DataFrame(format_values(df.to_numpy(dtype='float64'), **kwargs), index=df.index, columns=df.columns)
+
+
+def format_ratios(ratio_df, kinds):
+    percent = [c for c in ratio_df.columns if kinds[c] == 'percent']
+    decimal = [c for c in ratio_df.columns if kinds[c] != 'percent']
+    out = pd.concat([
+        format_frame(ratio_df[percent], unit=0.01, decimals=2, suffix='%', grouping=False),
+        format_frame(ratio_df[decimal], decimals=2, grouping=False)
+    ], axis=1)
+    return out[ratio_df.columns]
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+BASE_CURRENCY = 'IDR'
+CURRENCY_PREFIXES = {'IDR': 'Rp. ', 'USD': '$', 'EUR': '€', 'GBP': '£', 'JPY': '¥', 'SGD': 'S$'}
+RATE_COLUMNS = ['Date', 'Currency', 'Closing', 'Average']
+
+
+def currency_prefix(code):
+    return CURRENCY_PREFIXES.get(code, f'{code} ')
+
+
+class RateTable:
+    # Month-end (closing) and monthly average rates, each quoted as units of
+    # BASE_CURRENCY per unit of the currency; any pair crosses through the base.
+
+    def __init__(self, rows):
+        rates = pd.DataFrame(list(rows), columns=RATE_COLUMNS)
+        rates['Date'] = pd.to_datetime(rates['Date']) + pd.offsets.MonthEnd(0)
+        rates = rates[rates['Currency'] != BASE_CURRENCY].drop_duplicates(['Date', 'Currency'], keep='last')
+        self.closing = rates.pivot(index='Date', columns='Currency', values='Closing').astype('float64')
+        self.average = rates.pivot(index='Date', columns='Currency', values='Average').astype('float64')
+        self.currencies = [BASE_CURRENCY] + sorted(self.closing.columns)
+
+    def _rates(self, table, dates, currency):
+        if currency == BASE_CURRENCY:
+            return np.ones(len(dates))
+        if currency not in table.columns:
+            return np.full(len(dates), np.nan)
+        return table[currency].reindex(dates).to_numpy()
+
+    def factors(self, dates, source, target, average=False):
+        # Units of `target` per unit of `source` at each date; NaN where a rate
+        # is missing, so untranslatable months show blank rather than wrong.
+        table = self.average if average else self.closing
+        return self._rates(table, dates, source) / self._rates(table, dates, target)
+
+
+def translate(df, rates, source, target, fields, flow_fields):
+    # Balance sheet fields at the month-end rate and income statement fields at
+    # the month's average rate, each as one column-block multiply.
+    if source == target or df.empty:
+        return df
+    dates = pd.DatetimeIndex(df['Date'])
+    flow = [f for f in fields if f in flow_fields]
+    stock = [f for f in fields if f not in flow_fields]
+    out = df.copy()
+    out[stock] = df[stock].to_numpy(dtype='float64', na_value=np.nan) * rates.factors(dates, source, target)[:, None]
+    out[flow] = df[flow].to_numpy(dtype='float64', na_value=np.nan) * rates.factors(dates, source, target, average=True)[:, None]
+    return out
@@ -0,0 +1,34 @@
+import json
+from collections import deque
+
+HISTORY_BYTES = 1 << 20
+
+
+class History:
+    # Bounded undo/redo stacks of (label, op, inverse, nbytes) deltas. Entries are
+    # sized by their serialized ops and the oldest go first once over budget.
+
+    def __init__(self, budget=HISTORY_BYTES):
+        self.budget = budget
+        self.undo_stack = deque()
+        self.redo_stack = deque()
+        self.size = 0
+
+    def record(self, label, op, inverse):
+        self.size -= sum(entry[3] for entry in self.redo_stack)
+        self.redo_stack.clear()
+        nbytes = len(json.dumps(op)) + len(json.dumps(inverse))
+        self.undo_stack.append((label, op, inverse, nbytes))
+        self.size += nbytes
+        while self.size > self.budget and (self.undo_stack or self.redo_stack):
+            self.size -= (self.undo_stack or self.redo_stack).popleft()[3]
+
+    def undo(self):
+        entry = self.undo_stack.pop()
+        self.redo_stack.append(entry)
+        return entry[0], entry[2]
+
+    def redo(self):
+        entry = self.redo_stack.pop()
+        self.undo_stack.append(entry)
+        return entry[0], entry[1]
@@ -0,0 +1,320 @@
+import csv
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+BATCH_ROWS = 10_000
+CSV_CHUNK_BYTES = 8 << 20
+CSV_WORKERS = os.cpu_count() or 1
+ENTITY, DATE, ROW, SHEET = 'Entity', 'Date', '_row', '_sheet'
+LAYOUTS = ('records', 'sheets')
+# Order for a file whose numeric dates all read both ways (05/06/2024): day
+# first, the local convention for the IDR figures kept here.
+DAYFIRST = True
+DATE_ORDERS = {True: 'DD/MM/YYYY', False: 'MM/DD/YYYY'}
+NUMERIC_DATE = r'^\s*(\d{1,2})[./-](\d{1,2})[./-](\d{4})\s*$'
+
+
+class ImportValidationError(ValueError):
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__(f"{len(problems)} problem(s), first: {problems[0]}")
+
+
+def normalize(label):
+    return re.sub(r'[^a-z0-9]+', ' ', str(label).lower()).strip()
+
+
+def default_mapping(fields):
+    return {f: f for f in [ENTITY, DATE] + fields}
+
+
+def resolve(headers, mapping, fields):
+    # Sheet label -> target, matched on a normalized form so case, spacing and
+    # punctuation differences ("total operating exp") still map.
+    lookup = {normalize(k): v for k, v in mapping.items() if v in [ENTITY, DATE] + fields}
+    return [lookup.get(normalize(h)) if h is not None else None for h in headers]
+
+
+def _numeric_parts(values):
+    # First, second and year parts of dates written as numbers (31/03/2024);
+    # NaN for anything else.
+    text = pd.Series(values, dtype='object').astype('string')
+    return text.str.extract(NUMERIC_DATE).astype('float64')
+
+
+def date_order(values):
+    # How many distinct numeric dates read only day first, and only month first.
+    parts = _numeric_parts(pd.unique(pd.Series(values, dtype='object')))
+    return int(((parts[0] > 12) & (parts[1] <= 12)).sum()), int(((parts[1] > 12) & (parts[0] <= 12)).sum())
+
+
+def parse_dates(values, dayfirst=DAYFIRST):
+    # Shared by the Excel and CSV paths and parsed once per distinct value.
+    # Numeric dates follow `dayfirst`; ISO dates, month names and Excel date
+    # cells read only one way.
+    codes, uniques = pd.factorize(pd.Series(values, dtype='object'))
+    parts = _numeric_parts(uniques)
+    numeric = parts[0].notna().to_numpy()
+    parsed = pd.to_datetime(pd.Series(uniques, dtype='object').where(~numeric), errors='coerce', format='mixed')
+    if numeric.any():
+        day, month = (parts[0], parts[1]) if dayfirst else (parts[1], parts[0])
+        ymd = pd.DataFrame({'year': parts[2], 'month': month, 'day': day})[numeric]
+        parsed[numeric] = pd.to_datetime(ymd, errors='coerce').astype(parsed.dtype)
+    return parsed.iloc[codes].where(codes >= 0).reset_index(drop=True)
+
+
+def unreadable(dates):
+    # Dates no order can read; which order the rest follow is only settled
+    # once the whole file is in (see settle_dates).
+    return (parse_dates(dates, True).isna() & parse_dates(dates, False).isna()).to_numpy()
+
+
+def settle_dates(dates, dayfirst=None):
+    # Reads a whole file's dates in one order: the one given, else the one its
+    # unambiguous numeric dates agree on (the majority if they don't). Returns
+    # the dates, NaT where one doesn't read in that order, and the order.
+    if dayfirst is None:
+        day, month = date_order(dates)
+        dayfirst = day >= month if day or month else DAYFIRST
+    return parse_dates(dates, dayfirst).set_axis(dates.index), dayfirst
+
+
+def _settle(parts, dayfirst, where):
+    # The validated parts of a file as one frame, dates settled and snapped
+    # to month end, with a problem for each row whose date doesn't read in the
+    # file's order; where() labels those rows.
+    frame = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=[ENTITY, DATE, ROW, SHEET])
+    dates, dayfirst = settle_dates(frame[DATE], dayfirst)
+    bad = frame[dates.isna()]
+    problems = [f"{label}: date {value!r} does not read as {DATE_ORDERS[dayfirst]}, the order of this file's dates"
+                for label, value in zip(where(bad), bad[DATE])]
+    frame[DATE] = dates + pd.offsets.MonthEnd(0)
+    return frame.drop(columns=[ROW, SHEET], errors='ignore'), problems
+
+
+def validate(entities, dates, values, fields, rows):
+    # One vectorized pass per batch: numbers parse via a single to_numeric over
+    # the whole block, and any non-empty cell that fails to parse is reported
+    # by sheet row and field. Dates stay as read until settle_dates.
+    problems = []
+    entities = pd.Series(entities, dtype='object').astype('string').str.strip()
+    block = np.asarray(values, dtype='object').reshape(len(entities), len(fields))
+    numbers = pd.to_numeric(pd.Series(block.ravel()), errors='coerce').to_numpy(dtype='float64').reshape(block.shape)
+    filled = pd.notna(block) & (block != '')
+    for i in np.flatnonzero(entities.isna() | (entities == '')):
+        problems.append(f"row {rows[i]}: missing entity")
+    for i in np.flatnonzero(unreadable(dates)):
+        problems.append(f"row {rows[i]}: invalid date {dates[i]!r}")
+    for i, j in zip(*np.nonzero(filled & np.isnan(numbers))):
+        problems.append(f"row {rows[i]}: {fields[j]} is not a number ({block[i, j]!r})")
+    frame = pd.DataFrame(np.nan_to_num(numbers), columns=fields)
+    frame.insert(0, ROW, np.asarray(rows))
+    frame.insert(0, DATE, pd.Series(dates, dtype='object'))
+    frame.insert(0, ENTITY, entities)
+    return frame, problems
+
+
+def _combine(rows):
+    # One frame per entity and month. The last value wins per field, and fields
+    # no sheet or column mapped stay NaN so the import leaves them as stored.
+    out = {}
+    for entity, frame in rows.groupby(ENTITY, sort=False):
+        frame = frame.drop(columns=ENTITY).reset_index(drop=True)
+        if frame[DATE].duplicated().any():
+            out[entity] = frame.groupby(DATE, sort=True).last().reset_index()
+        else:
+            out[entity] = frame.sort_values(DATE, ignore_index=True)
+    return out
+
+
+def merge_rows(rows, existing, fields):
+    # Fills the fields the file didn't carry: from the stored row for months
+    # that exist, zero for new ones.
+    old = existing.set_index(DATE)[fields].reindex(rows[DATE]).set_axis(rows.index)
+    out = rows.copy()
+    out[fields] = rows[fields].fillna(old).fillna(0.0)
+    return out
+
+
+def _records(ws, mapping, fields, batch_rows):
+    rows = ws.iter_rows(values_only=True)
+    targets = resolve(next(rows, ()), mapping, fields)
+    if ENTITY not in targets or DATE not in targets:
+        raise ImportValidationError([f"sheet {ws.title}: no columns mapped to {ENTITY} and {DATE}"])
+    e, d = targets.index(ENTITY), targets.index(DATE)
+    cols = [(i, t) for i, t in enumerate(targets) if t in fields]
+    mapped = [t for _, t in cols]
+    idx = [i for i, _ in cols]
+    batch = []
+    for n, row in enumerate(rows, start=2):
+        if not any(v is not None for v in row):
+            continue
+        row = row + (None,) * (len(targets) - len(row))
+        batch.append((n, row[e], row[d], [row[i] for i in idx]))
+        if len(batch) >= batch_rows:
+            yield mapped, batch
+            batch = []
+    if batch:
+        yield mapped, batch
+
+
+def _sheet(ws, mapping, fields):
+    # One entity per sheet, named after it: fields down the first column and
+    # months across the header row, like the Storage pivot.
+    rows = ws.iter_rows(values_only=True)
+    dates = list(next(rows, ()))[1:]
+    mapped, values = [], []
+    for row in rows:
+        target = resolve(row[:1], mapping, fields)[0]
+        if target in fields:
+            mapped.append(target)
+            values.append(list(row[1:len(dates) + 1]) + [None] * (len(dates) + 1 - len(row)))
+    keep = [j for j, d in enumerate(dates) if d is not None]
+    block = np.asarray(values, dtype='object').reshape(len(mapped), len(dates))[:, keep].T if mapped else np.empty((len(keep), 0), dtype='object')
+    batch = [(1, ws.title, dates[j], list(r)) for j, r in zip(keep, block)]
+    if batch:
+        yield mapped, batch
+
+
+def read_workbook(source, fields, mapping=None, layout='records', batch_rows=BATCH_ROWS, progress=None, dayfirst=None):
+    # Streams the workbook (read_only keeps memory flat however large it is)
+    # and validates it batch by batch. Returns one frame per entity (see
+    # _combine); nothing is returned unless every batch of every sheet
+    # validated. Numeric dates follow `dayfirst`, or the order inferred for
+    # the whole workbook when it is None.
+    if openpyxl is None:
+        raise ImportError("openpyxl is required for Excel import")
+    mapping = mapping or default_mapping(fields)
+    wb = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    parts, problems = [], []
+    try:
+        for s, ws in enumerate(wb.worksheets):
+            batches = _records(ws, mapping, fields, batch_rows) if layout == 'records' else _sheet(ws, mapping, fields)
+            try:
+                for mapped, batch in batches:
+                    rows, entities, dates, values = zip(*batch)
+                    frame, found = validate(entities, dates, [v for vs in values for v in vs], mapped, rows)
+                    problems.extend(f"sheet {ws.title}, {p}" for p in found)
+                    if not found:
+                        parts.append(frame.reindex(columns=[ENTITY, DATE, ROW] + fields).assign(**{SHEET: s}))
+                    if progress:
+                        progress(s, len(wb.worksheets), len(batch))
+            except ImportValidationError as e:
+                problems.extend(e.problems)
+        titles = [ws.title for ws in wb.worksheets]
+    finally:
+        wb.close()
+    frame, found = _settle(parts, dayfirst, lambda bad: (f"sheet {titles[s]}, row {r}" for s, r in zip(bad[SHEET], bad[ROW])))
+    problems.extend(found)
+    if problems:
+        raise ImportValidationError(problems)
+    return _combine(frame)
+
+
+def _csv_chunks(fh, size):
+    # Byte ranges cut on line ends, so each parses on its own; a quoted field
+    # spanning lines is not supported.
+    first = 2
+    while True:
+        block = fh.read(size)
+        if not block:
+            return
+        block += fh.readline()
+        yield block, first
+        first += block.count(b'\n')
+
+
+def _parse_csv(block, first_row, columns, entity, fields):
+    # columns maps source position -> target. Types come from an explicit dtype
+    # map so the C parser converts numbers as it tokenizes; only a chunk that
+    # fails to convert is re-read as text to report the offending cells.
+    dtypes = {i: 'float64' if t in fields else 'string' for i, t in columns.items()}
+    mapped = [t for t in columns.values() if t in fields]
+    try:
+        raw = pd.read_csv(io.BytesIO(block), header=None, usecols=list(columns), dtype=dtypes, skip_blank_lines=False)
+    except ValueError:
+        raw = pd.read_csv(io.BytesIO(block), header=None, usecols=list(columns), dtype='object', skip_blank_lines=False)
+        raw = raw.dropna(how='all').rename(columns=columns)
+        entities = raw[ENTITY] if ENTITY in raw else [entity] * len(raw)
+        return validate(list(entities), list(raw[DATE]), raw[mapped].to_numpy().ravel(), mapped, first_row + raw.index)
+    raw = raw.dropna(how='all').rename(columns=columns)
+    problems = []
+    entities = raw[ENTITY].str.strip() if ENTITY in raw else pd.Series(entity, index=raw.index, dtype='string')
+    for i in raw.index[(entities.isna() | (entities == '')).to_numpy()]:
+        problems.append(f"row {first_row + i}: missing entity")
+    for i in raw.index[unreadable(raw[DATE])]:
+        problems.append(f"row {first_row + i}: invalid date {raw[DATE][i]!r}")
+    frame = raw[mapped].fillna(0.0)
+    frame.insert(0, ROW, first_row + raw.index)
+    frame.insert(0, DATE, raw[DATE])
+    frame.insert(0, ENTITY, entities)
+    return frame, problems
+
+
+def read_csv(source, fields, mapping=None, entity=None, chunk_bytes=CSV_CHUNK_BYTES, workers=CSV_WORKERS, progress=None, dayfirst=None):
+    # Splits the file into line-aligned byte chunks and parses them on a thread
+    # pool, at most two chunks per worker in flight so memory stays bounded.
+    # Files without an entity column load into `entity`. Returns one frame per
+    # entity like read_workbook, and likewise only when every chunk validated.
+    mapping = mapping or default_mapping(fields)
+    fh = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+    try:
+        total = fh.seek(0, io.SEEK_END)
+        fh.seek(0)
+        header = next(csv.reader([fh.readline().decode('utf-8-sig')]), [])
+        columns = {}
+        for i, target in enumerate(resolve(header, mapping, fields)):
+            if target is not None and target not in columns.values():
+                columns[i] = target
+        if DATE not in columns.values() or (ENTITY not in columns.values() and not entity):
+            raise ImportValidationError([f"no columns mapped to {DATE}" + ("" if entity else f" and {ENTITY}")])
+        parts, problems, pending, rows = [], [], [], 0
+
+        def collect(future, done):
+            nonlocal rows
+            frame, found = future.result()
+            problems.extend(found)
+            rows += len(frame)
+            if not found:
+                parts.append(frame.reindex(columns=[ENTITY, DATE, ROW] + fields))
+            if progress:
+                progress(done, total, rows)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for block, first in _csv_chunks(fh, chunk_bytes):
+                pending.append((pool.submit(_parse_csv, block, first, columns, entity, fields), fh.tell()))
+                if len(pending) >= 2 * workers:
+                    collect(*pending.pop(0))
+            for future, done in pending:
+                collect(future, done)
+    finally:
+        if fh is not source:
+            fh.close()
+    frame, found = _settle(parts, dayfirst, lambda bad: (f"row {r}" for r in bad[ROW]))
+    problems.extend(found)
+    if problems:
+        raise ImportValidationError(problems)
+    return _combine(frame)
+
+
+def changed_rows(rows, existing, fields):
+    # Rows whose Date is new or whose values differ from what is stored, so a
+    # re-delivered extract upserts only what actually moved.
+    if existing.empty:
+        return rows
+    # Compared exactly: both sides are float64 parsed from text, and a relative
+    # tolerance would swallow small corrections to large Rupiah amounts.
+    new = rows[fields].to_numpy(dtype='float64')
+    old = existing.set_index(DATE)[fields].reindex(rows[DATE]).to_numpy(dtype='float64', na_value=np.nan)
+    same = ((new == old) | (np.isnan(new) & np.isnan(old))).all(axis=1)
+    return rows[~same]
@@ -0,0 +1,145 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+BASES = ('Monthly', 'TTM', 'YTD')
+GRANULARITIES = ('Monthly', 'Quarterly', 'Annual')
+PERIOD_MONTHS = {'Monthly': 1, 'Quarterly': 3, 'Annual': 12}
+
+
+def month_ordinal(dates):
+    dates = pd.DatetimeIndex(dates)
+    return np.asarray(dates.year * 12 + dates.month - 1, dtype='int64')
+
+
+def period_end(dates, granularity, fiscal_start=1):
+    # Month-end date closing the (fiscal) quarter or year each date falls in.
+    n = PERIOD_MONTHS[granularity]
+    ordinals = month_ordinal(dates)
+    close = ordinals + n - 1 - (ordinals - fiscal_start + 1) % n
+    return pd.PeriodIndex.from_ordinals(close - 1970 * 12, freq='M').to_timestamp(how='end').normalize()
+
+
+def period_label(dates, granularity, fiscal_start=1):
+    dates = pd.DatetimeIndex(dates)
+    if granularity == 'Monthly':
+        return dates.strftime('%b %Y')
+    ordinals = month_ordinal(dates)
+    offset = (ordinals - fiscal_start + 1) % 12
+    year = pd.Index((ordinals + 11 - offset) // 12).astype(str)
+    if granularity == 'Annual':
+        return 'FY' + year
+    return 'Q' + pd.Index(offset // 3 + 1).astype(str) + ' ' + year
+
+
+def _window_sums(ordinals, values, starts):
+    # Sums values over [starts, ordinals] on a dense month grid using one
+    # cumulative sum per field; a window with any missing month comes back NaN
+    # instead of silently summing fewer months.
+    lo = ordinals.min()
+    pos = ordinals - lo
+    span = pos.max() + 1
+    dense = np.zeros((span, values.shape[1]))
+    present = np.zeros(span, dtype='int64')
+    dense[pos] = np.nan_to_num(values)
+    present[pos] = 1
+    sums = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(dense, axis=0)])
+    counts = np.concatenate([[0], np.cumsum(present)])
+    first = starts - lo
+    valid = (first >= 0) & (counts[pos + 1] - counts[np.maximum(first, 0)] == pos - first + 1)
+    out = sums[pos + 1] - sums[np.maximum(first, 0)]
+    out[~valid] = np.nan
+    return out
+
+
+def aggregate(df, basis, flow_fields, fiscal_start=1):
+    # Flow (income statement) fields become trailing-twelve-month or
+    # fiscal-year-to-date sums; stock (balance sheet) fields stay point-in-time.
+    flow = [f for f in flow_fields if f in df.columns]
+    if basis == 'Monthly' or df.empty or not flow:
+        return df
+    ordinals = month_ordinal(df['Date'])
+    starts = ordinals - 11 if basis == 'TTM' else ordinals - (ordinals - fiscal_start + 1) % 12
+    out = df.copy()
+    out[flow] = _window_sums(ordinals, df[flow].to_numpy(dtype='float64'), starts)
+    return out
+
+
+GROWTH_LAGS = {'MoM': 1, 'QoQ': 3, 'YoY': 12}
+
+
+def growth(df, fields, lag):
+    # Change against the same fields `lag` calendar months earlier, for all
+    # fields in one shifted-array pass over a dense month grid. A month with no
+    # row `lag` months back gets NaN rather than comparing against whatever row
+    # happens to precede it.
+    ordinals = month_ordinal(df['Date'])
+    values = df[fields].to_numpy(dtype='float64')
+    prev = np.full(values.shape, np.nan)
+    if len(df):
+        lo = ordinals.min()
+        pos = ordinals - lo
+        dense = np.full((pos.max() + 1, len(fields)), np.nan)
+        dense[pos] = values
+        back = pos - lag
+        prev[back >= 0] = dense[back[back >= 0]]
+    delta = values - prev
+    pct = np.full(values.shape, np.nan)
+    np.divide(delta, np.abs(prev), out=pct, where=np.isfinite(prev) & (prev != 0))
+    return (
+        pd.DataFrame(delta, index=df.index, columns=fields),
+        pd.DataFrame(pct, index=df.index, columns=fields)
+    )
+
+
+def rollup(df, granularity, fields, flow_fields, fiscal_start=1):
+    # Flow fields are summed over the months present in each period and stock
+    # fields take the last month's value. Months counts the months present, so
+    # a partial period (e.g. the current quarter) can be told apart.
+    flow = [f for f in fields if f in flow_fields]
+    stock = [f for f in fields if f not in flow_fields]
+    if df.empty:
+        return pd.DataFrame(columns=['Date'] + fields + ['Months']).astype({'Date': df['Date'].dtype, **dict.fromkeys(fields, 'float64'), 'Months': 'int64'})
+    rows = df.sort_values('Date')
+    groups = rows.groupby(period_end(rows['Date'], granularity, fiscal_start).rename('Date'))
+    out = pd.concat([groups[flow].sum(min_count=1), groups[stock].last(), groups.size().rename('Months')], axis=1)
+    return out[fields + ['Months']].reset_index()
+
+
+class Rollup:
+    # Quarterly or fiscal-year aggregates kept across reruns. refresh() takes the
+    # change log since the last refresh and re-aggregates only the periods that
+    # contain a changed month, so switching granularity never rescans the whole
+    # monthly frame.
+
+    def __init__(self, granularity, fields, flow_fields, fiscal_start=1):
+        self.granularity = granularity
+        self.fields = fields
+        self.flow_fields = flow_fields
+        self.fiscal_start = fiscal_start
+        self.values = None
+        self.version = None
+        self.refreshed = 0
+        self.lock = threading.Lock()
+
+    def _rollup(self, rows):
+        return rollup(rows, self.granularity, self.fields, self.flow_fields, self.fiscal_start)
+
+    def refresh(self, df, version, changes):
+        with self.lock:
+            if self.version == version:
+                return self.values
+            if self.values is None or changes is None:
+                self.values = self._rollup(df)
+                self.refreshed = len(self.values)
+            else:
+                ends = period_end(pd.DatetimeIndex(sorted({date for date, _ in changes})), self.granularity, self.fiscal_start).unique()
+                n = PERIOD_MONTHS[self.granularity]
+                months = pd.DatetimeIndex([end - pd.offsets.MonthEnd(k) for end in ends for k in range(n)])
+                fresh = self._rollup(df[df['Date'].isin(months)])
+                kept = self.values[~self.values['Date'].isin(ends)]
+                self.values = pd.concat([kept, fresh], ignore_index=True).sort_values('Date', ignore_index=True)
+                self.refreshed = len(ends)
+            self.version = version
+            return self.values
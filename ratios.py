@@ -0,0 +1,324 @@
+import re
+import time
+import functools
+import threading
+import numpy as np
+import pandas as pd
+
+RATIO_FIELDS = {
+    'Current Ratio': ('Current Asset / Current Liabilities', 'decimal'),
+    'Debt to Equity Ratio': ('Total Liabilities / Equity', 'decimal'),
+    'Operating Profit Margin (%)': ('Operating Income / Revenue', 'percent'),
+    'Net Profit Margin (%)': ('Net Income / Revenue', 'percent'),
+    'Return on Assets (ROA) (%)': ('Net Income / Total Asset', 'percent'),
+    'Return on Equity (ROE) (%)': ('Net Income / Equity', 'percent')
+}
+RATIO_KINDS = ('decimal', 'percent')
+NUMBER = re.compile(r'\d+(\.\d*)?|\.\d+')
+
+
+class RatioSyntaxError(ValueError):
+    pass
+
+
+def tokenize(expression, fields):
+    # Field names contain spaces and dots, so names are matched longest-first
+    # against the known fields rather than split on whitespace.
+    names = sorted(fields, key=len, reverse=True)
+    tokens, pos = [], 0
+    while pos < len(expression):
+        ch = expression[pos]
+        if ch.isspace():
+            pos += 1
+        elif ch in '+-*/()':
+            tokens.append(('op', ch))
+            pos += 1
+        elif (m := NUMBER.match(expression, pos)):
+            tokens.append(('const', float(m.group())))
+            pos = m.end()
+        else:
+            name = next((n for n in names if expression.startswith(n, pos)), None)
+            if name is None:
+                raise RatioSyntaxError(f"Unknown field at position {pos}: {expression[pos:]!r}")
+            tokens.append(('field', name))
+            pos += len(name)
+    return tokens
+
+
+def parse(expression, fields):
+    tokens = tokenize(expression, fields)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else (None, None)
+
+    def unexpected(tok):
+        found = 'end of expression' if tok[0] is None else repr(tok[1])
+        return RatioSyntaxError(f"Unexpected {found} in {expression!r}")
+
+    def take(kind, value=None):
+        nonlocal pos
+        tok = peek()
+        if tok[0] != kind or (value is not None and tok[1] != value):
+            raise unexpected(tok)
+        pos += 1
+        return tok[1]
+
+    def binary(operand, ops):
+        node = operand()
+        while peek()[0] == 'op' and peek()[1] in ops:
+            op = take('op')
+            rhs = operand()
+            # Commutative operands are ordered so a + b and b + a share a node.
+            node = (op,) + tuple(sorted((node, rhs), key=repr)) if op in '+*' else (op, node, rhs)
+        return node
+
+    def factor():
+        kind, value = peek()
+        if kind == 'op' and value == '-':
+            take('op')
+            return ('neg', factor())
+        if kind == 'op' and value == '(':
+            take('op')
+            node = expr()
+            take('op', ')')
+            return node
+        if kind in ('field', 'const'):
+            take(kind)
+            return (kind, value)
+        raise unexpected((kind, value))
+
+    def expr():
+        return binary(lambda: binary(factor, '*/'), '+-')
+
+    node = expr()
+    if pos != len(tokens):
+        raise unexpected(tokens[pos])
+    return node
+
+
+class RatioPlan:
+    # Flat evaluation plan for a set of ratio expressions. Every distinct
+    # subexpression becomes one step, so a term shared by many ratios (say
+    # Net Income / Revenue) is computed once per evaluation.
+
+    def __init__(self, ratios, fields):
+        self.names = list(ratios)
+        self.kinds = {name: kind for name, (_, kind) in ratios.items()}
+        self.inputs, self.steps, self.slots = [], [], {}
+        self.deps = {}
+        self.outputs = []
+        for name, (expression, kind) in ratios.items():
+            if kind not in RATIO_KINDS:
+                raise RatioSyntaxError(f"Unknown ratio kind {kind!r} for {name!r}")
+            node = parse(expression, fields)
+            self.outputs.append(self._emit(node))
+            self.deps[name] = set(self._fields(node))
+
+    def _fields(self, node):
+        if node[0] == 'field':
+            yield node[1]
+        elif node[0] != 'const':
+            for child in node[1:]:
+                yield from self._fields(child)
+
+    def _emit(self, node):
+        if node in self.slots:
+            return self.slots[node]
+        if node[0] == 'field':
+            self.inputs.append(node[1])
+            step = ('field', len(self.inputs) - 1)
+        elif node[0] == 'const':
+            step = node
+        else:
+            step = (node[0],) + tuple(self._emit(child) for child in node[1:])
+        self.steps.append(step)
+        self.slots[node] = len(self.steps) - 1
+        return self.slots[node]
+
+    def evaluate(self, values):
+        # values: float64 matrix with one column per entry of self.inputs.
+        regs = []
+        for step in self.steps:
+            op = step[0]
+            if op == 'field':
+                regs.append(values[:, step[1]])
+            elif op == 'const':
+                regs.append(np.float64(step[1]))
+            elif op == 'neg':
+                regs.append(-regs[step[1]])
+            elif op == '/':
+                num = np.broadcast_to(regs[step[1]], len(values))
+                den = np.broadcast_to(regs[step[2]], len(values))
+                out = np.full(len(values), np.nan)
+                np.divide(num, den, out=out, where=den != 0)
+                regs.append(out)
+            else:
+                regs.append(OPS[op](regs[step[1]], regs[step[2]]))
+        out = np.empty((len(values), len(self.outputs)))
+        for col, slot in enumerate(self.outputs):
+            out[:, col] = regs[slot]
+        return out
+
+
+OPS = {'+': np.add, '-': np.subtract, '*': np.multiply}
+
+
+@functools.lru_cache(maxsize=32)
+def _compile(items, fields):
+    return RatioPlan({name: (expression, kind) for name, expression, kind in items}, fields)
+
+
+def compile_ratios(ratios=RATIO_FIELDS, fields=None):
+    items = tuple((name, expression, kind) for name, (expression, kind) in ratios.items())
+    return _compile(items, tuple(fields))
+
+
+def compute_ratios(df, ratios=RATIO_FIELDS):
+    # All ratios in one pass: gather the referenced columns into a single
+    # float64 matrix and run the compiled plan over it. Zero denominators give
+    # NaN instead of inf.
+    plan = compile_ratios(ratios, [c for c in df.columns if isinstance(c, str)])
+    values = np.ascontiguousarray(df[plan.inputs].to_numpy(dtype='float64'))
+    return pd.DataFrame(plan.evaluate(values), index=df.index, columns=plan.names)
+
+
+def ratio_deps(ratios, fields):
+    return compile_ratios(ratios, fields).deps
+
+
+class IncrementalTable:
+    # Per-period results kept across reruns. refresh() takes the change log since
+    # the last refresh and recomputes only the affected cells: those whose inputs
+    # changed, plus, for window > 1, the periods whose trailing window covers a
+    # changed month. `versions` holds the data version each cell was computed at.
+
+    def __init__(self, compute, deps, window=1):
+        self.compute = compute
+        self.deps = deps
+        self.window = window
+        self.values = None
+        self.versions = None
+        self.version = None
+        self.recomputed = 0
+        self.lock = threading.Lock()
+
+    def refresh(self, df, version, changes):
+        with self.lock:
+            if self.version == version:
+                return self.values
+            if self.values is None or changes is None:
+                self._rebuild(df, version)
+            else:
+                self._update(df, version, changes)
+            self.version = version
+            return self.values
+
+    def _rebuild(self, df, version):
+        self.values = self.compute(df.sort_values('Date'))
+        self.versions = pd.DataFrame(version, index=self.values.index, columns=self.values.columns)
+        self.recomputed = self.values.size
+
+    def _update(self, df, version, changes):
+        cols = list(self.deps)
+        hit = {}
+        for date, field in changes:
+            touched = cols if field is None else [c for c in cols if field in self.deps[c]]
+            for k in range(self.window):
+                hit.setdefault(date + pd.offsets.MonthEnd(k), set()).update(touched)
+        hit = {d: c for d, c in hit.items() if c}
+        dates = pd.DatetimeIndex(sorted(hit))
+        gone = dates[~dates.isin(df['Date'])]
+        self.values = self.values.drop(gone, errors='ignore')
+        self.versions = self.versions.drop(gone, errors='ignore')
+        dates = dates[dates.isin(df['Date'])]
+        self.recomputed = 0
+        if dates.empty:
+            return
+        if self.window > 1:
+            lo = dates.min() - pd.offsets.MonthEnd(self.window - 1)
+            rows = df[(df['Date'] >= lo) & (df['Date'] <= dates.max())]
+        else:
+            rows = df[df['Date'].isin(dates)]
+        fresh = self.compute(rows.sort_values('Date')).reindex(dates)
+        mask = pd.DataFrame([[c in hit[d] for c in cols] for d in dates], index=dates, columns=cols)
+        new = dates.difference(self.values.index)
+        self.values = pd.concat([self.values, pd.DataFrame(np.nan, index=new, columns=cols)])
+        self.versions = pd.concat([self.versions, pd.DataFrame(version, index=new, columns=cols)])
+        self.values.loc[dates] = self.values.loc[dates].where(~mask, fresh)
+        self.versions.loc[dates] = self.versions.loc[dates].where(~mask, version)
+        self.recomputed = int(mask.to_numpy().sum())
+
+
+
+PEER_STATS = ('Count', 'Q1', 'Median', 'Q3')
+
+
+def peer_stats(values):
+    # Cross-entity comparison of a ratio frame indexed by (Entity, Date). The
+    # rows are laid out as a (period, entity, ratio) cube and sorted once along
+    # the entity axis; ranks, percentiles and quartiles for every period and
+    # ratio are read off that single sort. Rank 1 is the highest value and ties
+    # share the better rank; percentile is the share of the other peers with a
+    # strictly lower value, so ties share the lower percentile.
+    values = values.copy()
+    values.index = values.index.remove_unused_levels()
+    entities, dates = values.index.levels
+    e, d = values.index.codes
+    cube = np.full((len(dates), len(entities), values.shape[1]), np.nan)
+    cube[d, e] = values.to_numpy(dtype='float64', na_value=np.nan)
+    order = np.argsort(cube, axis=1, kind='stable')
+    ranked = np.take_along_axis(cube, order, axis=1)
+    n = np.isfinite(cube).sum(axis=1, keepdims=True)
+    pos = np.arange(len(entities))[None, :, None]
+    last = (pos == len(entities) - 1) | (ranked != np.roll(ranked, -1, axis=1))
+    end = np.where(last, pos, len(entities))
+    end = np.flip(np.minimum.accumulate(np.flip(end, axis=1), axis=1), axis=1)
+    first = (pos == 0) | (ranked != np.roll(ranked, 1, axis=1))
+    start = np.maximum.accumulate(np.where(first, pos, 0), axis=1)
+    rank = np.empty_like(cube)
+    np.put_along_axis(rank, order, n - end, axis=1)
+    rank[~np.isfinite(cube)] = np.nan
+    below = np.empty_like(cube)
+    np.put_along_axis(below, order, start, axis=1)
+    percentile = np.full(cube.shape, np.nan)
+    np.divide(below, n - 1, out=percentile, where=np.isfinite(rank) & (n > 1))
+    percentile[np.isfinite(rank) & (n == 1)] = 1
+    stats = [n[:, 0].astype('float64')]
+    for q in (0.25, 0.5, 0.75):
+        at = q * np.maximum(n[:, 0] - 1, 0)
+        lo = np.take_along_axis(ranked, np.floor(at).astype('int64')[:, None], axis=1)[:, 0]
+        hi = np.take_along_axis(ranked, np.ceil(at).astype('int64')[:, None], axis=1)[:, 0]
+        stats.append(np.where(n[:, 0] > 0, lo + (hi - lo) * (at - np.floor(at)), np.nan))
+    flat = lambda a: pd.DataFrame(a[d, e], index=values.index, columns=values.columns)
+    summary = pd.DataFrame(
+        np.stack(stats, axis=1).reshape(-1, values.shape[1]),
+        index=pd.MultiIndex.from_product([dates, PEER_STATS], names=[values.index.names[1], 'Stat']),
+        columns=values.columns
+    )
+    return flat(rank), flat(percentile * 100), summary
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    fields = [f'Field {i}' for i in range(20)]
+    custom = {
+        f'Ratio {i}': (f'({a} - {b}) / {c}' if i % 2 else f'{a} / ({b} + {c})', 'decimal')
+        for i, (a, b, c) in enumerate(rng.choice(fields, (300, 3)))
+    }
+    legacy = {
+        name: lambda df, e=expression: df.eval(e.replace('Field ', 'Field_')).replace([np.inf, -np.inf], np.nan)
+        for name, (expression, _) in custom.items()
+    }
+    for rows in (240, 24_000):
+        df = pd.DataFrame(rng.integers(0, 1000, (rows, len(fields))) * 1e6, columns=fields)
+        start = time.perf_counter()
+        renamed = df.rename(columns=lambda c: c.replace('Field ', 'Field_'))
+        old = pd.DataFrame({name: func(renamed) for name, func in legacy.items()})
+        mid = time.perf_counter()
+        new = compute_ratios(df, custom)
+        end = time.perf_counter()
+        assert np.allclose(old.to_numpy(), new.to_numpy(), equal_nan=True)
+        plan = compile_ratios(custom, fields)
+        print(f"{len(custom)} ratios x {rows:>6} rows: per-ratio eval {(mid - start) * 1e3:8.2f} ms, "
+              f"plan {(end - mid) * 1e3:8.2f} ms ({len(plan.steps)} steps)")
@@ -0,0 +1,446 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import closing
+from urllib.parse import quote, unquote
+import pandas as pd
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+COMPACT_EVERY = 200
+DELETED = 'Deleted'
+
+
+def _iso(dates):
+    return pd.to_datetime(pd.Series(list(dates))).dt.strftime('%Y-%m-%d').tolist()
+
+
+def upsert_op(rows):
+    rows = rows.copy()
+    rows['Date'] = _iso(rows['Date'])
+    return {'op': 'upsert', 'rows': rows.to_dict('records')}
+
+
+def delete_op(dates):
+    return {'op': 'delete', 'dates': _iso(dates)}
+
+
+def tombstone_op(dates, at):
+    return {'op': 'tombstone', 'dates': _iso(dates), 'at': float(at)}
+
+
+def purge_op(before):
+    return {'op': 'purge', 'before': float(before)}
+
+
+def batch_op(ops):
+    return {'op': 'batch', 'ops': list(ops)}
+
+
+def edit_op(cells):
+    cells = pd.DataFrame(cells, columns=['Date', 'Field', 'Value'])
+    dates = _iso(cells['Date'])
+    return {'op': 'edit', 'cells': [list(c) for c in zip(dates, cells['Field'], cells['Value'].astype('float64').tolist())]}
+
+
+def atomic_write(path, writer):
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        writer(tmp)
+        with open(tmp, 'rb+') as fh:
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(os.path.dirname(path) or '.', os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class FileLock:
+    # Exclusive writer lock: a thread lock for sessions in this process plus an
+    # OS lock on <path> for other processes. Readers never take it; they only
+    # ever see whole files because writers publish through atomic_write.
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.Lock()
+        self.fh = None
+
+    def __enter__(self):
+        self.local.acquire()
+        try:
+            self.fh = open(self.path, 'a+')
+            if fcntl is not None:
+                fcntl.flock(self.fh.fileno(), fcntl.LOCK_EX)
+            else:
+                self.fh.seek(0)
+                msvcrt.locking(self.fh.fileno(), msvcrt.LK_LOCK, 1)
+        except BaseException:
+            if self.fh is not None:
+                self.fh.close()
+            self.local.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.fh.fileno(), fcntl.LOCK_UN)
+            else:
+                self.fh.seek(0)
+                msvcrt.locking(self.fh.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.fh.close()
+            self.fh = None
+            self.local.release()
+
+
+def changed_keys(op):
+    if op['op'] == 'batch':
+        return set().union(*(changed_keys(o) for o in op['ops']))
+    if op['op'] == 'upsert':
+        return {(pd.Timestamp(r['Date']), None) for r in op['rows']}
+    if op['op'] in ('delete', 'tombstone'):
+        return {(pd.Timestamp(d), None) for d in op['dates']}
+    if op['op'] == 'purge':
+        return set()
+    return {(pd.Timestamp(d), f) for d, f, _ in op['cells']}
+
+
+def inverse_op(df, op):
+    # The op that takes the frame back to its state before `op` was applied,
+    # holding old values only for the rows or cells `op` touches.
+    if op['op'] == 'batch':
+        ops = []
+        for o in op['ops']:
+            ops.insert(0, inverse_op(df, o))
+            df = apply_op(df, o)
+        return batch_op(ops)
+    if op['op'] == 'edit':
+        cells = pd.DataFrame(op['cells'], columns=['Date', 'Field', 'Value'])
+        rows = pd.Index(df['Date']).get_indexer(pd.to_datetime(cells['Date']))
+        keep = (rows >= 0) & cells['Field'].isin(df.columns).to_numpy()
+        cells, rows = cells[keep], rows[keep]
+        fields = pd.Index(cells['Field'].unique())
+        old = df[fields].to_numpy(dtype='float64')[rows, fields.get_indexer(cells['Field'])]
+        return edit_op(zip(cells['Date'], cells['Field'], old))
+    if op['op'] == 'purge':
+        return batch_op([])
+    dates = pd.to_datetime([r['Date'] for r in op['rows']] if op['op'] == 'upsert' else op['dates'])
+    old = df[df['Date'].isin(dates)]
+    ops = [upsert_op(old)] if not old.empty else []
+    added = dates[~dates.isin(df['Date'])]
+    if op['op'] == 'upsert' and len(added):
+        ops.append(delete_op(added))
+    return ops[0] if len(ops) == 1 else batch_op(ops)
+
+
+def apply_op(df, op):
+    if op['op'] == 'batch':
+        for o in op['ops']:
+            df = apply_op(df, o)
+        return df
+    if op['op'] == 'upsert':
+        rows = pd.DataFrame(op['rows'])
+        rows['Date'] = pd.to_datetime(rows['Date'])
+        rows = rows.reindex(columns=df.columns)
+        return pd.concat([df[~df['Date'].isin(rows['Date'])], rows], ignore_index=True)
+    if op['op'] == 'delete' or (op['op'] == 'tombstone' and DELETED not in df.columns):
+        return df[~df['Date'].isin(pd.to_datetime(op['dates']))].reset_index(drop=True)
+    if op['op'] == 'tombstone':
+        df = df.copy()
+        df.loc[df['Date'].isin(pd.to_datetime(op['dates'])), DELETED] = op['at']
+        return df
+    if op['op'] == 'purge':
+        if DELETED not in df.columns:
+            return df
+        return df[~(df[DELETED] < op['before'])].reset_index(drop=True)
+    cells = pd.DataFrame(op['cells'], columns=['Date', 'Field', 'Value'])
+    rows = pd.Index(df['Date']).get_indexer(pd.to_datetime(cells['Date']))
+    keep = (rows >= 0) & cells['Field'].isin(df.columns).to_numpy()
+    cells, rows = cells[keep], rows[keep]
+    fields = pd.Index(cells['Field'].unique())
+    block = df[fields].to_numpy(dtype='float64', copy=True)
+    block[rows, fields.get_indexer(cells['Field'])] = cells['Value'].to_numpy(dtype='float64')
+    df = df.copy()
+    df[fields] = block
+    return df
+
+
+class CsvStorage:
+    ext = 'csv'
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = list(fields)
+        self.lock = FileLock(path + '.lock')
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def files(self):
+        return [self.path]
+
+    def empty(self, columns=None):
+        return self.coerce(pd.DataFrame(columns=columns or ['Date'] + self.fields), columns)
+
+    def coerce(self, df, columns=None):
+        columns = columns or ['Date'] + self.fields
+        df = df.reindex(columns=columns)
+        if 'Date' in df.columns:
+            df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+        for f in columns:
+            if f in self.fields:
+                df[f] = pd.to_numeric(df[f], errors='coerce').fillna(0).astype('float64')
+        if DELETED in df.columns:
+            df[DELETED] = pd.to_numeric(df[DELETED], errors='coerce').astype('float64')
+        return df
+
+    def read(self, columns=None, deleted=False):
+        # Tombstoned rows stay in the file until purged; deleted=True returns
+        # them along with the Deleted column, for replay and compaction.
+        columns = columns or ['Date'] + self.fields
+        df = self._read(columns + [DELETED]) if self.exists() else self.empty(columns + [DELETED])
+        return df if deleted else self.live(df, columns)
+
+    def live(self, df, columns=None):
+        return df[df[DELETED].isna()].reset_index(drop=True)[columns or ['Date'] + self.fields]
+
+    def _read(self, columns):
+        wanted = set(columns)
+        return self.coerce(pd.read_csv(self.path, usecols=lambda c: c in wanted), columns)
+
+    def _write(self, df):
+        df = self.coerce(df.copy(), ['Date'] + self.fields + [DELETED])
+        atomic_write(self.path, lambda p: df.to_csv(p, index=False))
+
+    def write(self, df):
+        with self.lock:
+            self._write(df)
+
+    def apply(self, op):
+        with self.lock:
+            self._write(apply_op(self.read(deleted=True), op))
+
+
+class ParquetStorage(CsvStorage):
+    ext = 'parquet'
+
+    def _read(self, columns):
+        present = set(pq.read_schema(self.path).names)
+        wanted = [c for c in columns if c in present]
+        # Stored columns are already typed; coerce only fills in missing ones.
+        return self.coerce(pd.read_parquet(self.path, columns=wanted), columns)
+
+    def _write(self, df):
+        df = self.coerce(df.copy(), ['Date'] + self.fields + [DELETED])
+        atomic_write(self.path, lambda p: df.to_parquet(p, index=False))
+
+
+class SqliteStorage(CsvStorage):
+    ext = 'db'
+    table = 'financial_data'
+
+    def files(self):
+        # Commits land in the write-ahead log until a checkpoint, so it is part
+        # of the file identity load_data keys its cache on.
+        return [self.path, self.path + '-wal']
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        # WAL lets readers keep reading the last commit while a writer holds
+        # the lock, instead of blocking on the rollback journal.
+        conn.execute('PRAGMA journal_mode=WAL')
+        cols = ', '.join(f'"{f}" REAL NOT NULL DEFAULT 0' for f in self.fields)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} (Date TEXT PRIMARY KEY, {cols}, "{DELETED}" REAL)')
+        if DELETED not in [r[1] for r in conn.execute(f'PRAGMA table_info({self.table})')]:
+            conn.execute(f'ALTER TABLE {self.table} ADD COLUMN "{DELETED}" REAL')
+        return conn
+
+    def _params(self, rows, columns=None):
+        rows = self.coerce(rows.copy(), columns)
+        rows['Date'] = rows['Date'].dt.strftime('%Y-%m-%d')
+        return list(rows.itertuples(index=False, name=None))
+
+    def _upsert_sql(self):
+        cols = ', '.join(f'"{c}"' for c in ['Date'] + self.fields)
+        marks = ', '.join('?' * (len(self.fields) + 1))
+        updates = ', '.join([f'"{f}" = excluded."{f}"' for f in self.fields] + [f'"{DELETED}" = NULL'])
+        return f'INSERT INTO {self.table} ({cols}) VALUES ({marks}) ON CONFLICT(Date) DO UPDATE SET {updates}'
+
+    def _read(self, columns):
+        cols = ', '.join(f'"{c}"' for c in columns)
+        sql = f'SELECT {cols} FROM {self.table} ORDER BY Date'
+        with closing(self.connect()) as conn:
+            return self.coerce(pd.read_sql_query(sql, conn), columns)
+
+    def write(self, df):
+        with closing(self.connect()) as conn, conn:
+            conn.execute(f'DELETE FROM {self.table}')
+            conn.executemany(self._upsert_sql(), self._params(df))
+            if DELETED in df.columns:
+                conn.executemany(self._tombstone_sql(), self._params(df[df[DELETED].notna()], [DELETED, 'Date']))
+
+    def _tombstone_sql(self):
+        return f'UPDATE {self.table} SET "{DELETED}" = ? WHERE Date = ?'
+
+    def apply(self, op):
+        with closing(self.connect()) as conn, conn:
+            self._apply(conn, op)
+
+    def _apply(self, conn, op):
+        if op['op'] == 'batch':
+            for o in op['ops']:
+                self._apply(conn, o)
+        elif op['op'] == 'upsert':
+            rows = pd.DataFrame(op['rows'])
+            conn.executemany(self._upsert_sql(), self._params(rows))
+        elif op['op'] == 'delete':
+            conn.executemany(f'DELETE FROM {self.table} WHERE Date = ?', [(d,) for d in op['dates']])
+        elif op['op'] == 'tombstone':
+            conn.executemany(self._tombstone_sql(), [(op['at'], d) for d in op['dates']])
+        elif op['op'] == 'purge':
+            conn.execute(f'DELETE FROM {self.table} WHERE "{DELETED}" < ?', (op['before'],))
+        else:
+            cells = pd.DataFrame(op['cells'], columns=['Date', 'Field', 'Value'])
+            for field, group in cells[cells['Field'].isin(self.fields)].groupby('Field'):
+                conn.executemany(
+                    f'UPDATE {self.table} SET "{field}" = ? WHERE Date = ?',
+                    zip(group['Value'].tolist(), group['Date'].tolist())
+                )
+
+
+class JournaledStorage:
+    # Mutations are appended to <snapshot>.journal and fsynced one op at a time;
+    # reads replay the journal over the base snapshot until the next compaction.
+
+    def __init__(self, base, compact_every=COMPACT_EVERY):
+        self.base = base
+        self.path = base.path
+        self.fields = base.fields
+        self.journal = base.path + '.journal'
+        self.lock = base.lock
+        self.compact_every = compact_every
+        with self.lock:
+            self._repair()
+            self.pending = len(self.ops())
+
+    def _repair(self):
+        if not os.path.exists(self.journal):
+            return
+        with open(self.journal, 'rb+') as fh:
+            data = fh.read()
+            if data and not data.endswith(b'\n'):
+                fh.truncate(data.rfind(b'\n') + 1)
+
+    def exists(self):
+        return self.base.exists() or os.path.exists(self.journal)
+
+    def files(self):
+        return [self.path, self.journal]
+
+    def coerce(self, df, columns=None):
+        return self.base.coerce(df, columns)
+
+    def ops(self):
+        if not os.path.exists(self.journal):
+            return []
+        # A line without its newline is an append still in flight.
+        with open(self.journal) as fh:
+            return [json.loads(line) for line in fh if line.endswith('\n') and line.strip()]
+
+    def _snapshot_id(self):
+        if not self.base.exists():
+            return None
+        st = os.stat(self.path)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def read(self, columns=None, deleted=False):
+        # Journal before snapshot, retried if a compaction published a new
+        # snapshot in between: replaying the old journal's prefix over it would
+        # undo later edits. A compaction that has replaced the snapshot but not
+        # yet truncated the journal is harmless, since replaying the full
+        # sequence over its own result changes nothing.
+        while True:
+            before = self._snapshot_id()
+            ops = self.ops()
+            df = self.base.read(deleted=True) if ops else self.base.read(columns, deleted)
+            if self._snapshot_id() == before:
+                break
+        if not ops:
+            return df
+        for op in ops:
+            df = apply_op(df, op)
+        df = self.base.coerce(df, ['Date'] + self.fields + [DELETED])
+        return df if deleted else self.base.live(df, columns)
+
+    def _write(self, df):
+        self.base._write(df)
+        open(self.journal, 'w').close()
+        self.pending = 0
+
+    def write(self, df):
+        with self.lock:
+            self._write(df)
+
+    def apply(self, op):
+        with self.lock:
+            with open(self.journal, 'a') as fh:
+                fh.write(json.dumps(op) + '\n')
+                fh.flush()
+                os.fsync(fh.fileno())
+            self.pending += 1
+            if self.pending >= self.compact_every:
+                self._write(self.read(deleted=True))
+
+    def compact(self):
+        with self.lock:
+            self._write(self.read(deleted=True))
+
+
+BACKENDS = {'csv': CsvStorage, 'parquet': ParquetStorage, 'sqlite': SqliteStorage}
+DEFAULT_BACKEND = 'parquet' if pq is not None else 'csv'
+
+
+def migrate(source, target):
+    target.write(source.read(deleted=True))
+    os.replace(source.path, source.path + '.migrated')
+
+
+def open_storage(kind, data_dir, fields, name='financial_data', journal=True):
+    os.makedirs(data_dir, exist_ok=True)
+    storage = BACKENDS[kind](os.path.join(data_dir, f'{name}.{BACKENDS[kind].ext}'), fields)
+    if journal and kind != 'sqlite':
+        storage = JournaledStorage(storage)
+    legacy = CsvStorage(os.path.join(data_dir, f'{name}.csv'), fields)
+    if kind != 'csv' and not storage.exists() and legacy.exists():
+        migrate(legacy, storage)
+    return storage
+
+
+def partition_name(entity):
+    # Entity names become file names: quoting keeps any name to one path
+    # component, and it is reversible so list_partitions can recover them.
+    return quote(entity, safe=' ').replace('.', '%2E')
+
+
+def list_partitions(data_dir):
+    if not os.path.isdir(data_dir):
+        return []
+    return sorted({unquote(f.split('.')[0]) for f in os.listdir(data_dir)})
+
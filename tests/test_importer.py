@@ -0,0 +1,82 @@
+import datetime
+import io
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from importer import DATE, ImportValidationError, changed_rows, merge_rows, read_csv, read_workbook
+
+FIELDS = ['Revenue', 'Equity']
+STORED = pd.DataFrame({DATE: pd.to_datetime(['2024-01-31', '2024-02-29']), 'Revenue': [1e12, 5.0], 'Equity': [2.0, 3.0]})
+
+
+def _months(frame):
+    return frame[DATE].dt.strftime('%Y-%m-%d').tolist()
+
+
+def _csv(text, **kwargs):
+    return read_csv(io.BytesIO(text.encode()), FIELDS, **kwargs)
+
+
+def _workbook(rows):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(['Entity', 'Date', 'Revenue'])
+    for row in rows:
+        ws.append(row)
+    out = io.BytesIO()
+    wb.save(out)
+    out.seek(0)
+    return out
+
+
+def test_small_corrections_to_large_amounts_count_as_changes():
+    rows = STORED.assign(Revenue=[1e12 + 5e6, 5.0])
+    assert _months(changed_rows(rows, STORED, FIELDS)) == ['2024-01-31']
+    assert changed_rows(STORED, STORED, FIELDS).empty
+
+
+def test_unmapped_fields_keep_stored_values():
+    rows = pd.DataFrame({DATE: pd.to_datetime(['2024-02-29', '2024-03-31']), 'Revenue': [6.0, 7.0], 'Equity': [np.nan, np.nan]})
+    assert merge_rows(rows, STORED, FIELDS)['Equity'].tolist() == [3.0, 0.0]
+
+
+@pytest.mark.parametrize('chunk', [1 << 20, 16])
+def test_dates_read_alike_whatever_chunk_they_land_in(chunk):
+    frame = _csv('Entity,Date,Revenue\nA,Jan 2024,1\nA,31/03/2024,2\nA,2024-02-29,3\nA,05/06/2024,4\n', chunk_bytes=chunk)['A']
+    assert _months(frame) == ['2024-01-31', '2024-02-29', '2024-03-31', '2024-06-30']
+
+
+@pytest.mark.parametrize('text, months', [
+    ('31/03/2024\n01/04/2024\n05/06/2024\n', ['2024-03-31', '2024-04-30', '2024-06-30']),
+    ('03/31/2024\n01/04/2024\n05/06/2024\n', ['2024-01-31', '2024-03-31', '2024-05-31']),
+])
+def test_one_date_order_per_file_from_its_unambiguous_dates(text, months):
+    frame = _csv('Date,Revenue\n' + text.replace('\n', ',1\n'), entity='A', chunk_bytes=16)['A']
+    assert _months(frame) == months
+
+
+def test_dates_against_the_file_order_are_reported():
+    with pytest.raises(ImportValidationError) as e:
+        _csv('Entity,Date,Revenue\nA,31/03/2024,1\nA,30/04/2024,2\nA,12/31/2024,3\n')
+    assert e.value.problems == ["row 4: date '12/31/2024' does not read as DD/MM/YYYY, the order of this file's dates"]
+    with pytest.raises(ImportValidationError) as e:
+        _csv('Entity,Date,Revenue\nA,31/03/2024,1\nA,05/06/2024,2\n', dayfirst=False)
+    assert e.value.problems == ["row 2: date '31/03/2024' does not read as MM/DD/YYYY, the order of this file's dates"]
+
+
+def test_workbook_dates_follow_one_order():
+    source = _workbook([['A', '31/03/2024', 1], ['A', '05/06/2024', 2], ['A', datetime.datetime(2024, 1, 15), 3]])
+    assert _months(read_workbook(source, FIELDS)['A']) == ['2024-01-31', '2024-03-31', '2024-06-30']
+    source = _workbook([['A', '31/03/2024', 1], ['A', '12/31/2024', 2], ['A', '30/04/2024', 3]])
+    with pytest.raises(ImportValidationError) as e:
+        read_workbook(source, FIELDS)
+    assert e.value.problems == ["sheet Sheet, row 3: date '12/31/2024' does not read as DD/MM/YYYY, the order of this file's dates"]
+
+
+def test_bad_rows_are_reported_by_row():
+    with pytest.raises(ImportValidationError) as e:
+        _csv('Entity,Date,Revenue\nA,nope,1\nA,2024-01-31,x\n')
+    assert e.value.problems == ["row 2: invalid date 'nope'", "row 3: Revenue is not a number ('x')"]
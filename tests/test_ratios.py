@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from ratios import peer_stats
+
+
+def _peers(values):
+    index = pd.MultiIndex.from_product([[f'E{i}' for i in range(len(values))], [pd.Timestamp('2024-01-31')]], names=['Entity', 'Date'])
+    return pd.DataFrame({'Ratio': values}, index=index)
+
+
+def test_ties_share_the_better_rank_and_the_lower_percentile():
+    rank, percentile, summary = peer_stats(_peers([3.0, 3.0, 3.0, 2.0, 2.0, 1.0]))
+    assert rank['Ratio'].tolist() == [1, 1, 1, 4, 4, 6]
+    assert np.allclose(percentile['Ratio'], [60, 60, 60, 20, 20, 0])
+
+
+def test_missing_values_are_left_out():
+    rank, percentile, summary = peer_stats(_peers([1.0, np.nan, 5.0, 3.0]))
+    assert np.allclose(rank['Ratio'], [3, np.nan, 1, 2], equal_nan=True)
+    assert np.allclose(percentile['Ratio'], [0, np.nan, 100, 50], equal_nan=True)
+    assert summary.xs('Count', level='Stat')['Ratio'].iloc[0] == 3